@@ -6,7 +6,8 @@ from routes.auth import auth_bp
 from routes.api import api_bp
 from flask_migrate import Migrate
 import os
-from extensions import db, cors
+from extensions import db, cors, strava_cache, strava_api, dem_tiles, parse_cache, upload_jobs, catalog_snapshot
+from utils.activity_store import save_upload_job
 
 load_dotenv()
 migrate = Migrate()
@@ -52,6 +53,18 @@ def ensure_phase3_columns(app):
                     conn.commit()
                 print("DB migration: Added manual_print_areas to product.")
 
+            user_cols = [c['name'] for c in inspector.get_columns('user')]
+            if 'strava_synced_until' not in user_cols:
+                with engine.connect() as conn:
+                    conn.execute(text('ALTER TABLE "user" ADD COLUMN strava_synced_until INTEGER'))
+                    conn.commit()
+                print("DB migration: Added strava_synced_until to user.")
+            if 'strava_backfill_before' not in user_cols:
+                with engine.connect() as conn:
+                    conn.execute(text('ALTER TABLE "user" ADD COLUMN strava_backfill_before INTEGER'))
+                    conn.commit()
+                print("DB migration: Added strava_backfill_before to user.")
+
         except Exception as e:
             print(f"WARNING: ensure_phase3_columns failed (may be OK): {e}")
 
@@ -60,6 +73,14 @@ def create_app(config_class=Config):
     app.config.from_object(config_class)
     db.init_app(app)
     migrate.init_app(app, db)
+    strava_cache.init_app(app)
+    strava_api.init_app(app)
+    dem_tiles.init_app(app)
+    parse_cache.init_app(app)
+    upload_jobs.init_app(app)
+    upload_jobs.on_done = save_upload_job
+    upload_jobs.cache = parse_cache
+    catalog_snapshot.init_app(app)
     cors.init_app(app, origins=["https://miles-to-merch.vercel.app", "http://localhost:8081"], supports_credentials=True)
     app.register_blueprint(auth_bp)
     app.register_blueprint(api_bp)
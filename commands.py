@@ -1,8 +1,10 @@
 import click
 import os
 import requests
-from extensions import db
+from extensions import db, catalog_snapshot
 from models import Product, Variant, PrintArea
+from utils.http_clients import printful
+from utils.catalog import publish_catalog
 
 def get_color_type_from_name(color_name):
     dark_keywords = ['black', 'charcoal', 'navy', 'dark', 'forest', 'maroon', 'burgundy']
@@ -24,6 +26,7 @@ def register_commands(app):
         print("Catalogus is leeg.")
 
         db.session.commit()
+        catalog_snapshot.bump()
         print("Catalogus is leeg. Gebruik de Admin Panel om producten toe te voegen via Printful.")
 
     @app.cli.command("sync-printful")
@@ -38,7 +41,7 @@ def register_commands(app):
         headers = {'Authorization': f'Bearer {API_KEY}'}
 
         try:
-            templates_response = requests.get('https://api.printful.com/product-templates', headers=headers)
+            templates_response = printful.get('https://api.printful.com/product-templates', headers=headers)
             templates_response.raise_for_status()
             templates_data = templates_response.json().get('result', {})
             templates = templates_data.get('items', [])
@@ -55,7 +58,7 @@ def register_commands(app):
                 
                 print(f"\nVerwerken van template: {template_product_name} (Product ID: {template_product_id})")
 
-                details_response = requests.get(f'https://api.printful.com/products/{template_product_id}', headers=headers)
+                details_response = printful.get(f'https://api.printful.com/products/{template_product_id}', headers=headers)
                 details_response.raise_for_status()
                 product_details = details_response.json().get('result', {})
                 product_data = product_details.get('product', {})
@@ -107,4 +110,17 @@ def register_commands(app):
             print(f"Onverwachte fout tijdens synchronisatie: {e}")
             db.session.rollback()
 
+        # Ook bij een fout kunnen producten al gewijzigd zijn
+        catalog_snapshot.bump()
         print("\nSynchronisatie voltooid!")
+
+    @app.cli.command("publish-catalog")
+    @click.option('--out', 'out_dir', default=None,
+                  help='Doelmap, standaard CATALOG_PUBLISH_DIR of frontend/public/catalog.')
+    def publish_catalog_command(out_dir):
+        """Schrijft /api/products en elke /api/products/<id> als statische JSON (content hash in de naam)."""
+        out_dir = out_dir or app.config.get('CATALOG_PUBLISH_DIR') or \
+            os.path.join(app.root_path, 'frontend', 'public', 'catalog')
+        manifest = publish_catalog(out_dir)
+        print(f"{len(manifest['product'])} producten gepubliceerd naar {out_dir} "
+              f"(catalogusversie {manifest['version']}, lijst: {manifest['products']}).")
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 basedir = os.path.abspath(os.path.dirname(__file__))
 load_dotenv()
@@ -28,6 +29,43 @@ class Config:
     # Strava API-instellingen
     STRAVA_CLIENT_ID = os.environ.get('STRAVA_CLIENT_ID')
     STRAVA_CLIENT_SECRET = os.environ.get('STRAVA_CLIENT_SECRET')
+    # Push subscription: the verify token we registered and the id Strava gave the subscription
+    STRAVA_WEBHOOK_VERIFY_TOKEN = os.environ.get('STRAVA_WEBHOOK_VERIFY_TOKEN')
+    STRAVA_WEBHOOK_SUBSCRIPTION_ID = os.environ.get('STRAVA_WEBHOOK_SUBSCRIPTION_ID')
+
+    # Strava response cache (memory LRU per worker, optional shared disk tier)
+    STRAVA_CACHE_TTL = int(os.environ.get('STRAVA_CACHE_TTL', 900))
+    STRAVA_CACHE_MAX_BYTES = int(os.environ.get('STRAVA_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    STRAVA_CACHE_DIR = os.environ.get('STRAVA_CACHE_DIR')
+
+    # Strava rate limit budget, shared by the workers on this machine
+    STRAVA_RATE_STATE_FILE = os.environ.get('STRAVA_RATE_STATE_FILE') or \
+        os.path.join(tempfile.gettempdir(), 'miles-to-merch-strava-rate.json')
+    STRAVA_BACKGROUND_RESERVE = float(os.environ.get('STRAVA_BACKGROUND_RESERVE', 0.2))
+
+    # Offline elevation model: directory with SRTM .hgt tiles (optional)
+    DEM_DIR = os.environ.get('DEM_DIR')
+
+    # Catalog version counter shared by the workers, bumped on every catalog edit
+    CATALOG_VERSION_FILE = os.environ.get('CATALOG_VERSION_FILE') or \
+        os.path.join(tempfile.gettempdir(), 'miles-to-merch-catalog-version')
+    # Static catalog JSON for the frontend host (flask publish-catalog); when set, admin edits republish
+    CATALOG_PUBLISH_DIR = os.environ.get('CATALOG_PUBLISH_DIR')
+
+    # Background parsing of activity uploads
+    UPLOAD_SPOOL_DIR = os.environ.get('UPLOAD_SPOOL_DIR') or \
+        os.path.join(tempfile.gettempdir(), 'miles-to-merch-uploads')
+    UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', 0)) or None # None: up to 4, one per core
+    UPLOAD_MAX_PENDING = int(os.environ.get('UPLOAD_MAX_PENDING', 32))
+    UPLOAD_MAX_BATCH_FILES = int(os.environ.get('UPLOAD_MAX_BATCH_FILES', 100))
+    # Unpacked size limits for ZIPs in a batch, per activity file and per archive
+    UPLOAD_MAX_MEMBER_BYTES = int(os.environ.get('UPLOAD_MAX_MEMBER_BYTES', 100 * 1024 * 1024))
+    UPLOAD_MAX_ARCHIVE_BYTES = int(os.environ.get('UPLOAD_MAX_ARCHIVE_BYTES', 1024 * 1024 * 1024))
+
+    # Parsed uploads by content hash, so re-uploading a file skips the parse
+    PARSE_CACHE_DIR = os.environ.get('PARSE_CACHE_DIR') or \
+        os.path.join(tempfile.gettempdir(), 'miles-to-merch-parse-cache')
+    PARSE_CACHE_MAX_BYTES = int(os.environ.get('PARSE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
 
     # Printful API Settings
     PRINTFUL_API_KEY = os.environ.get('PRINTFUL_API_KEY')
@@ -1,6 +1,19 @@
 # In extensions.py
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
+from utils.strava_cache import StravaCache
+from utils.dem import DemTiles
+from utils.upload_jobs import UploadJobs
+from utils.parse_cache import ParseCache
+from utils.catalog_snapshot import CatalogSnapshot
+from utils.strava_scheduler import StravaScheduler
+from utils.http_clients import strava
 
 db = SQLAlchemy()
-cors = CORS()
\ No newline at end of file
+cors = CORS()
+strava_cache = StravaCache()
+strava_api = StravaScheduler(strava)
+dem_tiles = DemTiles()
+parse_cache = ParseCache()
+upload_jobs = UploadJobs()
+catalog_snapshot = CatalogSnapshot()
\ No newline at end of file
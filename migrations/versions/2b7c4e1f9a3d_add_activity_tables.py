@@ -0,0 +1,88 @@
+"""Add Activity and ActivityStream tables
+
+Revision ID: 2b7c4e1f9a3d
+Revises: 1a6f35dd8bec
+Create Date: 2026-10-18 10:12:31.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision = '2b7c4e1f9a3d'
+down_revision = '1a6f35dd8bec'
+branch_labels = None
+depends_on = None
+
+
+def table_exists(table_name):
+    """Check if a table already exists (db.create_all() at startup may have made it)."""
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    return table_name in inspector.get_table_names()
+
+
+def upgrade():
+    if not table_exists('activity'):
+        create_activity_table()
+    if not table_exists('activity_stream'):
+        create_activity_stream_table()
+
+
+def create_activity_table():
+    op.create_table('activity',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('source', sa.String(length=10), nullable=False),
+        sa.Column('external_id', sa.String(length=64), nullable=False),
+        sa.Column('name', sa.String(length=255), nullable=True),
+        sa.Column('sport_type', sa.String(length=50), nullable=True),
+        sa.Column('start_date', sa.DateTime(), nullable=True),
+        sa.Column('distance', sa.Float(), nullable=True),
+        sa.Column('moving_time', sa.Integer(), nullable=True),
+        sa.Column('elapsed_time', sa.Integer(), nullable=True),
+        sa.Column('total_elevation_gain', sa.Float(), nullable=True),
+        sa.Column('summary', sa.JSON(), nullable=False),
+        sa.Column('photos', sa.JSON(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'source', 'external_id', name='uq_activity_user_source_external')
+    )
+    with op.batch_alter_table('activity', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_activity_user_id'), ['user_id'], unique=False)
+
+
+def create_activity_stream_table():
+    op.create_table('activity_stream',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('activity_id', sa.Integer(), nullable=False),
+        sa.Column('stream_type', sa.String(length=32), nullable=False),
+        sa.Column('length', sa.Integer(), nullable=False),
+        sa.Column('columns', sa.Integer(), nullable=False),
+        sa.Column('encoding', sa.String(length=32), nullable=False),
+        sa.Column('data', sa.LargeBinary(), nullable=False),
+        sa.Column('valid_mask', sa.LargeBinary(), nullable=True),
+        sa.Column('series_type', sa.String(length=20), nullable=True),
+        sa.Column('resolution', sa.String(length=10), nullable=True),
+        sa.ForeignKeyConstraint(['activity_id'], ['activity.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('activity_id', 'stream_type', name='uq_activity_stream_type')
+    )
+    with op.batch_alter_table('activity_stream', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_activity_stream_activity_id'), ['activity_id'], unique=False)
+
+
+def downgrade():
+    if table_exists('activity_stream'):
+        with op.batch_alter_table('activity_stream', schema=None) as batch_op:
+            batch_op.drop_index(batch_op.f('ix_activity_stream_activity_id'))
+        op.drop_table('activity_stream')
+
+    if table_exists('activity'):
+        with op.batch_alter_table('activity', schema=None) as batch_op:
+            batch_op.drop_index(batch_op.f('ix_activity_user_id'))
+        op.drop_table('activity')
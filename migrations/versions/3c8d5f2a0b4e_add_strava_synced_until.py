@@ -0,0 +1,39 @@
+"""Add strava_synced_until and strava_backfill_before to user
+
+Revision ID: 3c8d5f2a0b4e
+Revises: 2b7c4e1f9a3d
+Create Date: 2026-10-18 11:40:05.118230
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision = '3c8d5f2a0b4e'
+down_revision = '2b7c4e1f9a3d'
+branch_labels = None
+depends_on = None
+
+
+def column_exists(table_name, column_name):
+    """Check if a column already exists (ensure_phase3_columns() at startup may have added it)."""
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    columns = [col['name'] for col in inspector.get_columns(table_name)]
+    return column_name in columns
+
+
+def upgrade():
+    for column_name in ('strava_synced_until', 'strava_backfill_before'):
+        if not column_exists('user', column_name):
+            with op.batch_alter_table('user', schema=None) as batch_op:
+                batch_op.add_column(sa.Column(column_name, sa.Integer(), nullable=True))
+
+
+def downgrade():
+    for column_name in ('strava_backfill_before', 'strava_synced_until'):
+        if column_exists('user', column_name):
+            with op.batch_alter_table('user', schema=None) as batch_op:
+                batch_op.drop_column(column_name)
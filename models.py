@@ -2,6 +2,7 @@ from extensions import db
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy import func
+from utils.stream_codec import ENCODING, encode_stream, decode_stream, stream_to_list
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -17,9 +18,12 @@ class User(db.Model):
     access_token = db.Column(db.String(128), nullable=True)
     refresh_token = db.Column(db.String(128), nullable=True)
     expires_at = db.Column(db.Integer, nullable=True)
+    strava_synced_until = db.Column(db.Integer, nullable=True) # Epoch of the newest synced Strava activity
+    strava_backfill_before = db.Column(db.Integer, nullable=True) # Older history still to sync starts before this epoch
     is_admin = db.Column(db.Boolean, default=False, nullable=False)
     designs = db.relationship('Design', backref='user', lazy=True, cascade="all, delete-orphan")
     orders = db.relationship('Order', backref='user', lazy=True, cascade="all, delete-orphan")
+    activities = db.relationship('Activity', backref='user', lazy='dynamic', cascade="all, delete-orphan")
 
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -58,8 +62,11 @@ class Product(db.Model):
     # Admin Manual Configurations
     manual_print_areas = db.Column(db.JSON, default={}) # Stores { 'front': { left, top, width, height, mockup_width, mockup_height, image_url, is_ghost }, ... }
 
-    def to_dict(self, include_inactive=False):
-        if include_inactive:
+    def to_dict(self, include_inactive=False, variants=None):
+        # variants: preloaded list (see utils/catalog.py), saves the per-product query
+        if variants is not None:
+            variants_list = variants
+        elif include_inactive:
             variants_list = self.variants.all()
         else:
             variants_list = self.variants.filter_by(is_active=True).all()
@@ -209,4 +216,112 @@ class Order(db.Model):
             'order_date': self.order_date.isoformat(), 'design_id': self.design_id,
             'design_name': design_name, 'product_name': product_name,
             'product_image_url': product_image_url
-        }
\ No newline at end of file
+        }
+
+class Activity(db.Model):
+    """Locally stored activity (from Strava or a GPX upload), so reopening it needs no upstream call."""
+    __table_args__ = (db.UniqueConstraint('user_id', 'source', 'external_id', name='uq_activity_user_source_external'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    source = db.Column(db.String(10), nullable=False, default='strava') # 'strava', or the upload format: 'gpx', 'tcx', 'fit'
+    external_id = db.Column(db.String(64), nullable=False) # Strava activity id or the GPX id
+    name = db.Column(db.String(255), nullable=True)
+    sport_type = db.Column(db.String(50), nullable=True)
+    start_date = db.Column(db.DateTime, nullable=True)
+    distance = db.Column(db.Float, nullable=True)
+    moving_time = db.Column(db.Integer, nullable=True)
+    elapsed_time = db.Column(db.Integer, nullable=True)
+    total_elevation_gain = db.Column(db.Float, nullable=True)
+    summary = db.Column(db.JSON, nullable=False) # Full Strava-shaped details, without streams
+    photos = db.Column(db.JSON, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    streams = db.relationship('ActivityStream', backref='activity', lazy=True, cascade="all, delete-orphan")
+
+    def set_summary(self, details):
+        self.summary = details
+        self.name = (details.get('name') or '')[:255] or None
+        self.sport_type = details.get('sport_type') or details.get('type')
+        self.distance = details.get('distance')
+        self.moving_time = details.get('moving_time')
+        self.elapsed_time = details.get('elapsed_time')
+        self.total_elevation_gain = details.get('total_elevation_gain')
+        start_date = details.get('start_date')
+        if start_date:
+            try:
+                self.start_date = datetime.fromisoformat(start_date.replace('Z', '+00:00')).replace(tzinfo=None)
+            except ValueError:
+                self.start_date = None
+
+    def set_stream(self, stream_type, values, valid=None, series_type=None, resolution=None):
+        """Adds or replaces one stream, stored as a compressed delta-encoded column."""
+        data, mask = encode_stream(stream_type, values, valid)
+        stream = next((s for s in self.streams if s.stream_type == stream_type), None)
+        if stream is None:
+            stream = ActivityStream(stream_type=stream_type)
+            self.streams.append(stream)
+        stream.length = len(values)
+        stream.columns = 2 if stream_type == 'latlng' else 1
+        stream.encoding = ENCODING
+        stream.data = data
+        stream.valid_mask = mask
+        stream.series_type = series_type
+        stream.resolution = resolution
+
+    def to_summary_dict(self):
+        """Compact list entry, shaped like Strava's SummaryActivity."""
+        summary = self.summary or {}
+        return {
+            'id': int(self.external_id) if self.external_id.isdigit() else self.external_id,
+            'name': self.name,
+            'type': summary.get('type'),
+            'sport_type': self.sport_type,
+            'start_date': summary.get('start_date'),
+            'start_date_local': summary.get('start_date_local'),
+            'distance': self.distance,
+            'moving_time': self.moving_time,
+            'elapsed_time': self.elapsed_time,
+            'total_elevation_gain': self.total_elevation_gain,
+            'map': {'summary_polyline': (summary.get('map') or {}).get('summary_polyline')}
+        }
+
+    def to_dict(self):
+        """Same shape as /api/activities/<id>: details, key_by_type streams and photos."""
+        details = dict(self.summary or {})
+        details['local_id'] = self.id
+        return {
+            'details': details,
+            'streams': {s.stream_type: s.to_dict() for s in self.streams},
+            'photos': self.photos or []
+        }
+
+    def __repr__(self):
+        return f'<Activity {self.source}:{self.external_id}>'
+
+class ActivityStream(db.Model):
+    __table_args__ = (db.UniqueConstraint('activity_id', 'stream_type', name='uq_activity_stream_type'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    activity_id = db.Column(db.Integer, db.ForeignKey('activity.id'), nullable=False, index=True)
+    stream_type = db.Column(db.String(32), nullable=False)
+    length = db.Column(db.Integer, nullable=False)
+    columns = db.Column(db.Integer, nullable=False, default=1)
+    encoding = db.Column(db.String(32), nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    valid_mask = db.Column(db.LargeBinary, nullable=True) # Packed bits, only when the stream has gaps
+    series_type = db.Column(db.String(20), nullable=True)
+    resolution = db.Column(db.String(10), nullable=True)
+
+    def values(self):
+        """Decoded (values, valid) numpy arrays."""
+        return decode_stream(self.stream_type, self.data, self.length, self.valid_mask, self.columns)
+
+    def to_dict(self):
+        values, valid = self.values()
+        return {
+            'data': stream_to_list(self.stream_type, values, valid),
+            'series_type': self.series_type or 'distance',
+            'original_size': self.length,
+            'resolution': self.resolution or 'high'
+        }
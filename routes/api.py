@@ -2,18 +2,39 @@ import requests
 import json
 from datetime import datetime
 from functools import wraps
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from flask import Blueprint, jsonify, request, session, current_app, url_for
-from models import User, Product, Variant, Design, Order
-from extensions import db
+from models import User, Product, Variant, Design, Order, Activity
+from extensions import db, strava_cache, strava_api, dem_tiles, parse_cache, upload_jobs, catalog_snapshot
 import base64
+import hashlib
 import os
+import tempfile
+import threading
 from uuid import uuid4
 import stripe
-from utils.gpx_parser import parse_gpx_to_strava_format
+from utils.activity_parser import parse_activity_file
+from utils.catalog import load_catalog, product_detail, dumps as catalog_dumps, publish_catalog
+from utils.parse_cache import spool_and_hash
+from utils.route_simplify import SIMPLIFY_LEVELS, simplify_indices, take_strava_streams
+from utils.best_efforts import compute_best_efforts, merge_best_efforts
+from utils.splits import compute_split_tables
+from utils.downsample import lttb_stream_indices
+from utils.http_clients import printful, configure_stripe, http_metrics
+from utils.strava_scheduler import INTERACTIVE, BACKGROUND, StravaRateLimited
+from utils.strava_tokens import refresh_strava_token
+from utils.activity_store import sync_strava_activities, sync_strava_background, list_strava_activities, SYNC_PAGE_SIZE, load_activity, save_strava_activity, save_gpx_activity, forget_activity_detail, delete_activity
+import numpy as np
+import polyline
+from sqlalchemy.orm import joinedload
 from sqlalchemy.orm.attributes import flag_modified
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
+# Shared pool for fanning out independent Strava calls within one request
+STRAVA_FANOUT_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix='strava-fanout')
+PHOTOS_TIMEOUT = 3  # seconds, photos are optional
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -24,72 +45,328 @@ def login_required(f):
 
     return decorated_function
 
-# --- GPX Upload Route ---
+def simplify_level_arg():
+    """Reads ?simplify=thumbnail|editor|print. Returns (level, error_response)."""
+    level = request.args.get('simplify')
+    if level and level not in SIMPLIFY_LEVELS:
+        return None, (jsonify({'error': f"Unknown simplify level, use one of: {', '.join(SIMPLIFY_LEVELS)}"}), 400)
+    return level, None
+
+def points_arg():
+    """Reads ?points=N for chart downsampling. Returns (points, error_response)."""
+    points = request.args.get('points')
+    if points is None:
+        return None, None
+    try:
+        points = int(points)
+    except ValueError:
+        points = 0
+    if points < 3:
+        return None, (jsonify({'error': 'points must be a number of at least 3'}), 400)
+    return points, None
+
+# --- Activity Upload Route ---
 @api_bp.route('/activities/upload-gpx', methods=['POST'])
+@api_bp.route('/activities/upload', methods=['POST'])
 @login_required
 def upload_gpx():
+    """
+    Parses an uploaded GPX, TCX or FIT file in the request (the format is
+    detected from the content). Prefer /uploads for big files.
+    """
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
     file = request.files['file']
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
+    level, error = simplify_level_arg()
+    if error:
+        return error
+    points, error = points_arg()
+    if error:
+        return error
         
     try:
-        activity_data = parse_gpx_to_strava_format(file.stream)
+        # Hash while spooling; a file we've parsed before comes straight from the cache
+        with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as spool:
+            digest = spool_and_hash(file.stream, spool)
+            key = parse_cache.key(digest)
+            activity_data = parse_cache.get(key)
+            if activity_data is None:
+                spool.seek(0)
+                activity_data = parse_activity_file(spool, dem=dem_tiles, digest=digest)
+                if activity_data:
+                    parse_cache.set(key, activity_data)
         if not activity_data:
-             return jsonify({'error': 'Could not parse GPX file'}), 400
-        return jsonify({'details': activity_data})
+             return jsonify({'error': 'Could not parse activity file'}), 400
+        try:
+            stored = save_gpx_activity(session['user_id'], activity_data)
+            activity_data['local_id'] = stored.id
+        except Exception as e:
+            db.session.rollback()
+            print(f"Could not store uploaded activity: {e}")
+        return parsed_activity_response(reduce_parsed_activity(activity_data, level, points))
         
     except Exception as e:
-        print(f"GPX Parse Error: {e}")
-        return jsonify({'error': 'Invaild GPX file'}), 400
-
-def refresh_strava_token(user):
-    if user.expires_at and datetime.now().timestamp() > user.expires_at:
-        print(f"Token for user {user.strava_id} has expired. Refreshing.")
-        payload = {
-            'client_id': current_app.config['STRAVA_CLIENT_ID'],
-            'client_secret': current_app.config['STRAVA_CLIENT_SECRET'],
-            'grant_type': 'refresh_token',
-            'refresh_token': user.refresh_token
-        }
-        response = requests.post('https://www.strava.com/oauth/token', data=payload)
-        response.raise_for_status()
-        new_tokens = response.json()
-        
-        user.access_token = new_tokens['access_token']
-        user.refresh_token = new_tokens['refresh_token']
-        user.expires_at = new_tokens['expires_at']
-        
-        db.session.commit()
-        print("Token successfully refreshed.")
-    return user
+        print(f"Activity file parse error: {e}")
+        return jsonify({'error': 'Invalid activity file'}), 400
+
+@api_bp.route('/uploads', methods=['POST'])
+@login_required
+def upload_activity():
+    """
+    Queues a GPX, TCX or FIT upload for parsing in the background and
+    answers at once with a job id; poll status_url for the parsed activity.
+    """
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file part'}), 400
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
+
+    job = upload_jobs.submit(session['user_id'], file, file.filename)
+    if job is None:
+        return jsonify({'error': 'Too many uploads are being processed, try again shortly'}), 503
+    return jsonify({
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'status_url': url_for('api.upload_job_status', job_id=job['job_id'])
+    }), 202
+
+@api_bp.route('/uploads/<job_id>')
+@login_required
+def upload_job_status(job_id):
+    """Status of an upload job; once done, the parsed activity (?simplify and ?points apply)."""
+    level, error = simplify_level_arg()
+    if error:
+        return error
+    points, error = points_arg()
+    if error:
+        return error
+
+    job = upload_jobs.get(job_id)
+    if not job or job['user_id'] != session['user_id'] or job.get('kind') == 'batch':
+        return jsonify({'error': 'Upload job not found'}), 404
+    if job['status'] == 'failed':
+        return jsonify({'job_id': job_id, 'status': 'failed', 'error': job.get('error')}), 400
+    if job['status'] != 'done':
+        return jsonify({'job_id': job_id, 'status': job['status']}), 202
+
+    activity_data = upload_jobs.result(job_id)
+    if job.get('local_id'):
+        activity_data['local_id'] = job['local_id']
+    return parsed_activity_response(reduce_parsed_activity(activity_data, level, points))
+
+@api_bp.route('/activities/upload-batch', methods=['POST'])
+@login_required
+def upload_batch():
+    """
+    Imports many activities at once (e.g. a club's marathon routes): any number
+    of GPX/TCX/FIT files and/or ZIPs of them under 'files'. They are parsed in
+    parallel in the background; poll status_url for progress and the results.
+    """
+    files = [f for f in request.files.getlist('files') + request.files.getlist('file') if f.filename]
+    if not files:
+        return jsonify({'error': 'No files uploaded'}), 400
+
+    batch = upload_jobs.submit_batch(session['user_id'], files)
+    if batch is None:
+        return jsonify({'error': 'Too many uploads are being processed, try again shortly'}), 503
+    if batch['status'] == 'failed':
+        return jsonify({'error': batch['error']}), 400
+    return jsonify({
+        'job_id': batch['job_id'],
+        'status': batch['status'],
+        'total': batch['total'],
+        'status_url': url_for('api.upload_batch_status', job_id=batch['job_id'])
+    }), 202
+
+@api_bp.route('/activities/upload-batch/<job_id>')
+@login_required
+def upload_batch_status(job_id):
+    """
+    Progress of a batch import, with per-file status. Once every file is
+    done it's the combined result: each file's activity summary and local_id.
+    """
+    batch = upload_jobs.get(job_id)
+    if not batch or batch['user_id'] != session['user_id'] or batch.get('kind') != 'batch':
+        return jsonify({'error': 'Upload batch not found'}), 404
+
+    done = batch['status'] != 'running'
+    files = batch['files'] if done else [
+        {k: v for k, v in entry.items() if k != 'activity'} for entry in batch['files']
+    ]
+    return jsonify({
+        'job_id': job_id,
+        'status': batch['status'],
+        'total': batch['total'],
+        'completed': batch['completed'],
+        'failed': batch['failed'],
+        'progress': batch['completed'] / batch['total'] if batch['total'] else 1.0,
+        'files': files,
+    }), 200 if done else 202
+
+def reduce_parsed_activity(activity_data, level=None, points=None):
+    """Applies ?simplify and ?points to a parsed activity whose 'streams' is an ActivityStreams."""
+    if level:
+        streams = activity_data['streams']
+        indices = simplify_indices(streams.get('latlng'), level)
+        activity_data['streams'] = streams.take(indices)
+        activity_data['map']['polyline'] = polyline.encode(streams.get('latlng')[indices].tolist())
+    if points:
+        streams = activity_data['streams']
+        numeric = {k: streams.float_values(k) for k in streams.keys() if k != 'latlng'}
+        activity_data['streams'] = streams.take(lttb_stream_indices(numeric, points))
+    return activity_data
+
+def parsed_activity_response(activity_data):
+    """
+    Serializes a parsed activity whose 'streams' is an ActivityStreams container.
+    ?format=binary returns the packed columns with the summary in the header,
+    otherwise the streams are written as compact JSON straight from the arrays.
+    """
+    streams = activity_data['streams']
+    summary = {k: v for k, v in activity_data.items() if k != 'streams'}
+
+    if request.args.get('format') == 'binary':
+        return current_app.response_class(streams.to_bytes(meta={'details': summary}),
+                                          mimetype='application/octet-stream')
+
+    summary_json = json.dumps(summary, separators=(',', ':'))
+    body = '{"details":' + summary_json[:-1] + ',"streams":' + streams.to_json() + '}}'
+    return current_app.response_class(body, mimetype='application/json')
 
 # --- Activity Routes ---
 @api_bp.route('/activities')
 def activities():
-    strava_tokens = None
-    
     if 'user_id' in session:
         user = User.query.get(session['user_id'])
         if user and user.access_token:
-            user = refresh_strava_token(user)
-            strava_tokens = {'access_token': user.access_token}
-    elif 'strava_guest_data' in session:
-        strava_tokens = session['strava_guest_data']
+            try:
+                page = int(request.args.get('page', 1))
+                per_page = int(request.args.get('per_page', SYNC_PAGE_SIZE))
+            except ValueError:
+                return jsonify({'error': 'page and per_page must be numbers'}), 400
+            if page < 1 or not 1 <= per_page <= SYNC_PAGE_SIZE:
+                return jsonify({'error': f'page must be at least 1, per_page between 1 and {SYNC_PAGE_SIZE}'}), 400
 
+            user = refresh_strava_token(user)
+            # One Strava call for what's new; the rest of the history is
+            # fetched in the background and the list is served from our store
+            try:
+                added, more = sync_strava_activities(user)
+                if added:
+                    print(f"Synced {added} new Strava activities for user {user.id}")
+                if more:
+                    schedule_strava_backfill(current_app._get_current_object(), user.id)
+            except requests.exceptions.RequestException as e:
+                db.session.rollback()
+                print(f"Strava sync failed for user {user.id}: {e}")
+                if user.strava_synced_until is None:
+                    return jsonify({'error': f'Failed to fetch Strava activities: {e}'}), 500
+            return jsonify(list_strava_activities(user.id, page, per_page))
+
+    strava_tokens = session.get('strava_guest_data')
     if not strava_tokens:
         return jsonify({'error': 'Not authenticated with Strava.'}), 401
 
     try:
         headers = {'Authorization': f'Bearer {strava_tokens["access_token"]}'}
         params = {'per_page': 200}
-        response = requests.get('https://www.strava.com/api/v3/athlete/activities', headers=headers, params=params)
+        response = strava_api.get('https://www.strava.com/api/v3/athlete/activities', headers=headers, params=params)
         response.raise_for_status()
         return jsonify(response.json())
+    except StravaRateLimited as e:
+        return jsonify({'error': str(e)}), 429, {'Retry-After': str(e.retry_after)}
     except requests.exceptions.HTTPError as e:
         return jsonify({'error': f'Failed to fetch Strava activities: {e}'}), 500
 
+STRAVA_SYNC_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix='strava-sync')
+_backfilling = set()  # user ids with a background sync queued in this worker
+_backfilling_lock = threading.Lock()
+
+def schedule_strava_backfill(app, user_id):
+    with _backfilling_lock:
+        if user_id in _backfilling:
+            return
+        _backfilling.add(user_id)
+    STRAVA_SYNC_POOL.submit(run_strava_backfill, app, user_id)
+
+def run_strava_backfill(app, user_id):
+    """Background job: the pages of a sync after the first one (see sync_strava_background)."""
+    try:
+        with app.app_context():
+            user = User.query.get(user_id)
+            if user and user.access_token:
+                user = refresh_strava_token(user)
+                added = sync_strava_background(user)
+                if added:
+                    print(f"Backfilled {added} Strava activities for user {user_id}")
+    except Exception as e:
+        print(f"Background Strava sync failed for user {user_id}: {e}")
+    finally:
+        with _backfilling_lock:
+            _backfilling.discard(user_id)
+
+STREAM_KEYS = 'time,distance,latlng,distance,altitude,velocity_smooth,heartrate,cadence,watts,temp,moving,grade_smooth'
+
+def cache_owner(strava_tokens):
+    """Cache namespace for a Strava login, so private activities never leak between athletes."""
+    if strava_tokens.get('strava_id'):
+        return str(strava_tokens['strava_id'])
+    return 'token-' + hashlib.sha1(strava_tokens['access_token'].encode('utf-8')).hexdigest()[:16]
+
+def fetch_activity_payload(activity_id, strava_tokens, priority=INTERACTIVE):
+    """
+    Returns (details, streams, photos) for a Strava activity. Each part is read
+    from strava_cache first; the missing ones are fetched concurrently.
+    """
+    owner = cache_owner(strava_tokens)
+    details = strava_cache.get('details', owner, activity_id)
+    streams = strava_cache.get('streams', owner, activity_id, STREAM_KEYS)
+    photos = strava_cache.get('photos', owner, activity_id)
+
+    headers = {'Authorization': f'Bearer {strava_tokens["access_token"]}'}
+    base_url = f'https://www.strava.com/api/v3/activities/{activity_id}'
+
+    # The calls are independent, so fire the missing ones together and wait for the slowest
+    main_future = streams_future = photos_future = None
+    if details is None:
+        main_future = STRAVA_FANOUT_POOL.submit(strava_api.get, base_url, headers=headers, priority=priority)
+    if streams is None:
+        streams_future = STRAVA_FANOUT_POOL.submit(strava_api.get, f'{base_url}/streams', headers=headers,
+                                                   params={'keys': STREAM_KEYS, 'key_by_type': 'true'},
+                                                   priority=priority)
+    if photos is None:
+        photos_future = STRAVA_FANOUT_POOL.submit(strava_api.get, f'{base_url}/photos', headers=headers,
+                                                  params={'size': 600}, timeout=PHOTOS_TIMEOUT,
+                                                  priority=BACKGROUND)
+
+    if main_future:
+        main_res = main_future.result()
+        main_res.raise_for_status()
+        details = main_res.json()
+        strava_cache.set('details', owner, activity_id, details)
+    if streams_future:
+        streams_res = streams_future.result()
+        streams_res.raise_for_status()
+        streams = streams_res.json()
+        strava_cache.set('streams', owner, activity_id, streams, STREAM_KEYS)
+
+    # Photos are a nice-to-have: a slow or failing call must not fail the editor
+    # (and is not cached, so the next open tries again)
+    if photos_future:
+        photos = []
+        try:
+            photos_res = photos_future.result(timeout=PHOTOS_TIMEOUT)
+            if photos_res.ok:
+                photos = photos_res.json()
+                strava_cache.set('photos', owner, activity_id, photos)
+        except (FutureTimeoutError, requests.exceptions.RequestException) as e:
+            print(f"Skipping photos for activity {activity_id}: {e}")
+
+    return details, streams, photos
+
 @api_bp.route('/activities/<int:activity_id>')
 def activity_details(activity_id):
     """
@@ -116,13 +393,26 @@ def activity_details(activity_id):
             'photos': []
         })
 
+    level, error = simplify_level_arg()
+    if error:
+        return error
+    points, error = points_arg()
+    if error:
+        return error
+
+    # Activities we stored before (e.g. behind a saved design) need no Strava call at all
+    stored = load_activity(session['user_id'], 'strava', activity_id) if 'user_id' in session else None
+    if stored:
+        payload = stored.to_dict()
+        return reduced_activity_response(payload['details'], payload['streams'], payload['photos'], level, points)
+
     strava_tokens = None
     
     if 'user_id' in session:
         user = User.query.get(session['user_id'])
         if user and user.access_token:
             user = refresh_strava_token(user)
-            strava_tokens = {'access_token': user.access_token}
+            strava_tokens = {'access_token': user.access_token, 'strava_id': user.strava_id}
     elif 'strava_guest_data' in session:
         strava_tokens = session['strava_guest_data']
 
@@ -130,42 +420,207 @@ def activity_details(activity_id):
         return jsonify({'error': 'Not authenticated with Strava.'}), 401
 
     try:
-        headers = {'Authorization': f'Bearer {strava_tokens["access_token"]}'}
-        
-        main_res = requests.get(f'https://www.strava.com/api/v3/activities/{activity_id}', headers=headers)
-        main_res.raise_for_status()
-        
-        keys = 'time,distance,latlng,distance,altitude,velocity_smooth,heartrate,cadence,watts,temp,moving,grade_smooth'
-        streams_res = requests.get(f'https://www.strava.com/api/v3/activities/{activity_id}/streams', headers=headers, params={'keys': keys, 'key_by_type': 'true'})
-        streams_res.raise_for_status()
-
-        photos_res = requests.get(f'https://www.strava.com/api/v3/activities/{activity_id}/photos', headers=headers, params={'size': 600})
-        
-        return jsonify({
-            'details': main_res.json(), 
-            'streams': streams_res.json(),
-            'photos': photos_res.json() if photos_res.ok else []
-        })
+        details, streams, photos = fetch_activity_payload(activity_id, strava_tokens)
+    except StravaRateLimited as e:
+        return jsonify({'error': str(e)}), 429, {'Retry-After': str(e.retry_after)}
     except requests.exceptions.HTTPError as e:
         return jsonify({'error': f'Failed to fetch activity details: {e}'}), 500
+    except requests.exceptions.Timeout as e:
+        return jsonify({'error': f'Strava did not respond in time: {e}'}), 504
+
+    if 'user_id' in session:
+        try:
+            save_strava_activity(session['user_id'], activity_id, details, streams, photos)
+        except Exception as e:
+            db.session.rollback()
+            print(f"Could not store activity {activity_id}: {e}")
+
+    return reduced_activity_response(details, streams, photos, level, points)
+
+def reduced_activity_response(details, streams, photos, level=None, points=None):
+    """
+    Adds our computed best efforts and split tables, applies ?simplify and
+    ?points to the key_by_type streams and returns the activity JSON.
+    """
+    def stream_data(key):
+        data = streams.get(key, {}).get('data')
+        return np.asarray(data, dtype=np.float64) if data else None
+
+    time_data = stream_data('time')
+    if time_data is not None:
+        distance_data, watts_data = stream_data('distance'), stream_data('watts')
+        computed = compute_best_efforts(
+            time_data, distance_data, watts=watts_data,
+            sport_type=details.get('sport_type') or details.get('type')
+        )
+        details['best_efforts'] = merge_best_efforts(details.get('best_efforts'), computed)
+        if distance_data is not None:
+            details['splits'] = compute_split_tables(
+                distance_data, time_data, altitude=stream_data('altitude'),
+                heartrate=stream_data('heartrate'), watts=watts_data, moving=stream_data('moving')
+            )
+
+    latlng = streams.get('latlng', {}).get('data')
+    if level and latlng:
+        # Thin every stream with the same indices so they stay aligned with latlng
+        indices = simplify_indices(latlng, level)
+        streams = take_strava_streams(streams, indices)
+        details.setdefault('map', {})['polyline'] = polyline.encode(streams['latlng']['data'])
+    if points:
+        numeric = {k: np.asarray(v.get('data') or [], dtype=np.float64)
+                   for k, v in streams.items() if k not in ('latlng', 'moving')}
+        streams = take_strava_streams(streams, lttb_stream_indices(numeric, points))
+
+    return jsonify({
+        'details': details, 
+        'streams': streams,
+        'photos': photos
+    })
+
+@api_bp.route('/activities/local/<int:local_id>')
+@login_required
+def stored_activity_details(local_id):
+    """Serves a stored activity (e.g. an uploaded GPX) by its local id, same shape as activity_details."""
+    level, error = simplify_level_arg()
+    if error:
+        return error
+    points, error = points_arg()
+    if error:
+        return error
+
+    activity = Activity.query.options(joinedload(Activity.streams)).filter_by(id=local_id).first()
+    if not activity:
+        return jsonify({'error': 'Activity not found'}), 404
+    if activity.user_id != session['user_id']:
+        return jsonify({'error': 'Forbidden'}), 403
+
+    payload = activity.to_dict()
+    return reduced_activity_response(payload['details'], payload['streams'], payload['photos'], level, points)
+
+@api_bp.route('/activities/<int:activity_id>/cache', methods=['DELETE'])
+def invalidate_activity_cache(activity_id):
+    """
+    Forgets the cached and stored Strava detail of an activity; it stays in
+    the list and the next open refetches it.
+    """
+    strava_tokens = None
+    if 'user_id' in session:
+        user = User.query.get(session['user_id'])
+        if user and user.access_token:
+            strava_tokens = {'access_token': user.access_token, 'strava_id': user.strava_id}
+    elif 'strava_guest_data' in session:
+        strava_tokens = session['strava_guest_data']
+
+    if not strava_tokens:
+        return jsonify({'error': 'Not authenticated with Strava.'}), 401
+
+    strava_cache.invalidate(cache_owner(strava_tokens), activity_id)
+    if 'user_id' in session:
+        forget_activity_detail(session['user_id'], 'strava', activity_id)
+    return jsonify({'message': 'Activity cache cleared'}), 200
+
+# --- Strava Push Subscription ---
+STRAVA_WEBHOOK_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix='strava-webhook')
+
+@api_bp.route('/strava-webhook', methods=['GET'])
+def strava_webhook_validate():
+    """Subscription handshake: echo hub.challenge when the verify token is ours."""
+    verify_token = current_app.config.get('STRAVA_WEBHOOK_VERIFY_TOKEN')
+    if (request.args.get('hub.mode') != 'subscribe' or not verify_token
+            or request.args.get('hub.verify_token') != verify_token):
+        return jsonify({'error': 'Invalid verification request'}), 403
+    return jsonify({'hub.challenge': request.args.get('hub.challenge')})
+
+@api_bp.route('/strava-webhook', methods=['POST'])
+def strava_webhook():
+    """
+    Strava push events. Strava wants a 200 within 2 seconds, so the event is
+    only queued here; ingest_strava_event does the fetching.
+    """
+    event = request.get_json(silent=True) or {}
+    subscription_id = current_app.config.get('STRAVA_WEBHOOK_SUBSCRIPTION_ID')
+    if subscription_id and str(event.get('subscription_id')) != str(subscription_id):
+        return jsonify(status='unknown subscription'), 403
+
+    if event.get('object_type') == 'activity' and event.get('aspect_type') in ('create', 'update', 'delete'):
+        STRAVA_WEBHOOK_POOL.submit(ingest_strava_event, current_app._get_current_object(), event)
+    return jsonify(status='ok'), 200
+
+def ingest_strava_event(app, event):
+    """
+    Background job for an activity event: stores the summary and the full
+    resolution streams of new activities, so the first open is a local read
+    with the same data a live fetch would give. Updates only refresh the
+    summary, deletes drop our copy.
+    """
+    activity_id = event.get('object_id')
+    aspect = event.get('aspect_type')
+    with app.app_context():
+        try:
+            user = User.query.filter_by(strava_id=event.get('owner_id')).first()
+            if not user or not user.access_token:
+                return
+            strava_cache.invalidate(cache_owner({'strava_id': user.strava_id}), activity_id)
+            if aspect == 'delete':
+                delete_activity(user.id, 'strava', activity_id)
+                return
+
+            user = refresh_strava_token(user)
+            strava_tokens = {'access_token': user.access_token, 'strava_id': user.strava_id}
+            stored = load_activity(user.id, 'strava', activity_id)
+            if aspect == 'update' and stored:
+                # Title, sport or privacy changed; the streams we have are still right
+                response = strava_api.get(f'https://www.strava.com/api/v3/activities/{activity_id}',
+                                          headers={'Authorization': f'Bearer {user.access_token}'},
+                                          priority=BACKGROUND)
+                response.raise_for_status()
+                stored.set_summary(response.json())
+                db.session.commit()
+                return
+
+            details, streams, photos = fetch_activity_payload(activity_id, strava_tokens, priority=BACKGROUND)
+            save_strava_activity(user.id, activity_id, details, streams, photos)
+            print(f"Prefetched Strava activity {activity_id} for user {user.id} ({aspect})")
+        except StravaRateLimited as e:
+            # The user's first open will fetch it instead
+            print(f"Skipping prefetch of Strava activity {activity_id}: {e}")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Strava webhook job for activity {activity_id} failed: {e}")
 
 # --- Product Routes ---
 @api_bp.route('/products')
 def products():
     try:
-        products = Product.query.all()
-        # Filter products that have at least one active variant
-        valid_products = []
-        for p in products:
-            p_dict = p.to_dict()
-            if p_dict['variants'] and len(p_dict['variants']) > 0:
-                valid_products.append(p_dict)
-                
-        return jsonify(valid_products)
+        # Only products with at least one active variant
+        return catalog_response('products', load_catalog)
     except Exception as e:
         print(f"ERROR in /api/products: {e}")
         return jsonify({'error': str(e)}), 500
 
+def catalog_response(key, build):
+    """
+    Serves a catalog payload from the snapshot with a strong ETag, answering
+    If-None-Match with 304. build() only runs after the catalog changed.
+    """
+    body, etag = catalog_snapshot.get(key, lambda: catalog_dumps(build()))
+    response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+def catalog_changed(*product_ids):
+    """
+    Call after committing a catalog change; the product ids are the ones
+    touched. With CATALOG_PUBLISH_DIR set, their static files are republished.
+    """
+    catalog_snapshot.bump()
+    publish_dir = current_app.config.get('CATALOG_PUBLISH_DIR')
+    if publish_dir:
+        try:
+            publish_catalog(publish_dir, product_ids)
+        except Exception as e:
+            print(f"Catalog publish failed: {e}")
+
 @api_bp.route('/admin/products')
 @login_required
 def admin_products():
@@ -175,9 +630,7 @@ def admin_products():
         return jsonify({'error': 'Admin privileges required'}), 403
         
     try:
-        products = Product.query.all()
-        # Pass include_inactive=True
-        return jsonify([p.to_dict(include_inactive=True) for p in products])
+        return jsonify(load_catalog(include_inactive=True))
     except Exception as e:
         print(f"ERROR in /api/admin/products: {e}")
         return jsonify({'error': str(e)}), 500
@@ -198,6 +651,7 @@ def update_product(product_id):
         product.description = data['description']
         
     db.session.commit()
+    catalog_changed(product.id)
     return jsonify(product.to_dict(include_inactive=True))
 
 @api_bp.route('/products/<int:product_id>/price', methods=['PUT'])
@@ -222,6 +676,7 @@ def update_product_price(product_id):
             variant.price = float(new_price)
             
         db.session.commit()
+        catalog_changed(product.id)
         return jsonify({'message': 'Prices updated successfully', 'product': product.to_dict(include_inactive=True)})
     except ValueError:
         return jsonify({'error': 'Invalid price format'}), 400
@@ -240,6 +695,7 @@ def update_variant(variant_id):
         variant.is_active = bool(data['is_active'])
         
     db.session.commit()
+    catalog_changed(variant.product_id)
     return jsonify(variant.to_dict())
 
 # --- Printful Catalog Integration ---
@@ -257,7 +713,7 @@ def get_printful_catalog():
         
     try:
         # Fetch all products from Printful Catalog
-        res = requests.get('https://api.printful.com/products', headers={'Authorization': f'Bearer {api_key}'})
+        res = printful.get('https://api.printful.com/products', headers={'Authorization': f'Bearer {api_key}'})
         res.raise_for_status()
         data = res.json()
         return jsonify(data.get('result', []))
@@ -276,7 +732,7 @@ def get_printful_catalog_details(printful_id):
     api_key = os.environ.get('PRINTFUL_API_KEY')
     headers = {'Authorization': f'Bearer {api_key}'}
     try:
-        res = requests.get(f'https://api.printful.com/products/{printful_id}', headers=headers)
+        res = printful.get(f'https://api.printful.com/products/{printful_id}', headers=headers)
         res.raise_for_status()
         data = res.json().get('result', {})
         product = data.get('product', {})
@@ -316,7 +772,7 @@ def import_product():
     
     try:
         # 1. Fetch Details
-        res = requests.get(f'https://api.printful.com/products/{printful_id}', headers=headers)
+        res = printful.get(f'https://api.printful.com/products/{printful_id}', headers=headers)
         res.raise_for_status()
         prod_data = res.json().get('result', {}).get('product', {})
         variants_data = res.json().get('result', {}).get('variants', [])
@@ -359,6 +815,7 @@ def import_product():
             db.session.add(variant)
             
         db.session.commit()
+        catalog_changed(new_product.id)
         return jsonify({'message': 'Imported', 'product': new_product.to_dict(include_inactive=True)})
         
     except Exception as e:
@@ -368,38 +825,8 @@ def import_product():
 
 @api_bp.route('/products/<int:product_id>', methods=['GET'])
 def get_single_product(product_id):
-    product = Product.query.get_or_404(product_id)
-    # Return compact variant data (no print_areas) for fast product detail page loading.
-    # The design editor fetches print_areas separately when needed.
-    variants_list = product.variants.filter_by(is_active=True).all()
-    compact_variants = [{
-        'id': v.id,
-        'printful_variant_id': v.printful_variant_id,
-        'product_name': product.name,
-        'color': v.color,
-        'color_code': v.color_code,
-        'size': v.size,
-        'price': v.price,
-        'printful_price': v.printful_price,
-        'in_stock': v.in_stock,
-        'merch_color_type': v.merch_color_type,
-        'image': v.image,
-        'image_urls': v.image_urls,
-        'image_base_path': v.image_base_path,
-        'available_regions': v.available_regions,
-        # print_areas omitted intentionally — fetched separately by the design editor
-    } for v in variants_list]
-    return jsonify({
-        'id': product.id,
-        'name': product.name,
-        'description': product.description,
-        'printful_product_id': product.printful_product_id,
-        'printful_name': product.printful_name,
-        'product_image_url': product.product_image_url,
-        'sponsored_settings': getattr(product, 'sponsored_settings', {}) or {},
-        'print_areas': {p.placement: p.to_dict() for p in product.print_areas},
-        'variants': compact_variants,
-    })
+    return catalog_response(('product', product_id),
+                            lambda: product_detail(Product.query.get_or_404(product_id)))
 
 
 @api_bp.route('/products/<int:product_id>', methods=['DELETE'])
@@ -419,6 +846,7 @@ def delete_product(product_id):
         Variant.query.filter_by(product_id=product.id).delete()
         db.session.delete(product)
         db.session.commit()
+        catalog_changed(product_id)
         return jsonify({'message': 'Product deleted'}), 200
     except Exception as e:
         db.session.rollback()
@@ -478,7 +906,7 @@ def estimate_pricing():
     # We don't have a store_id easily available here without fetching it, but orders/estimate-costs works without store_id if we don't calculate tax for a specific store.
     # Wait, earlier test said "This endpoint requires `store_id`!". We must fetch the store ID.
     try:
-        store_res = requests.get('https://api.printful.com/stores', headers=headers)
+        store_res = printful.get('https://api.printful.com/stores', headers=headers)
         store_res.raise_for_status()
         stores = store_res.json().get('result', [])
         if not stores:
@@ -491,12 +919,12 @@ def estimate_pricing():
         # Request 1: Base cost (first placement only)
         base_payload = copy.deepcopy(payload)
         base_payload["items"][0]["files"] = [files[0]] if files else []
-        res_base = requests.post(url, headers=headers, json=base_payload)
+        res_base = printful.post(url, headers=headers, json=base_payload)
         res_base.raise_for_status()
         base_subtotal = float(res_base.json().get('result', {}).get('costs', {}).get('subtotal', 0))
 
         # Request 2: Total cost with all placements
-        res_total = requests.post(url, headers=headers, json=payload)
+        res_total = printful.post(url, headers=headers, json=payload)
         res_total.raise_for_status()
         total_subtotal = float(res_total.json().get('result', {}).get('costs', {}).get('subtotal', 0))
         
@@ -529,7 +957,7 @@ def get_printful_product_details(product_id):
     url = f'https://api.printful.com/products/{product.printful_product_id}'
 
     try:
-        response = requests.get(url, headers=headers)
+        response = printful.get(url, headers=headers)
         response.raise_for_status()
         data = response.json().get('result', {})
         
@@ -746,11 +1174,14 @@ def get_athlete_stats(athlete_id):
     try:
         headers = {'Authorization': f'Bearer {user.access_token}'}
 
-        response = requests.get(f'https://www.strava.com/api/v3/athletes/{athlete_id}/stats', headers=headers)
+        response = strava_api.get(f'https://www.strava.com/api/v3/athletes/{athlete_id}/stats', headers=headers)
         response.raise_for_status()
 
         return jsonify(response.json())
 
+    except StravaRateLimited as e:
+        return jsonify({'error': str(e)}), 429, {'Retry-After': str(e.retry_after)}
+
     except requests.exceptions.HTTPError as e:
         return jsonify({'error': f'Failed to fetch Strava athlete stats: {e}'}), 500
 
@@ -849,6 +1280,7 @@ def create_checkout_session():
         }), 400
 
     stripe.api_key = current_app.config['STRIPE_SECRET_KEY']
+    configure_stripe(stripe)
     frontend_url = current_app.config['FRONTEND_URL']
 
     try:
@@ -959,7 +1391,7 @@ def stripe_webhook():
 
         try:
             store_id = current_app.config.get('PRINTFUL_STORE_ID')
-            response = requests.post(f'https://api.printful.com/stores/{store_id}/orders', headers=headers, json=printful_payload)
+            response = printful.post(f'https://api.printful.com/stores/{store_id}/orders', headers=headers, json=printful_payload)
             response.raise_for_status()
             printful_order_data = response.json().get('result', {})
 
@@ -1012,6 +1444,7 @@ def update_manual_print_areas(product_id):
     try:
         product.manual_print_areas = data['manual_print_areas']
         db.session.commit()
+        catalog_changed(product.id)
         return jsonify({'message': 'Manual print areas updated successfully', 'manual_print_areas': product.manual_print_areas})
     except Exception as e:
         print(f'ERROR in update_manual_print_areas: {e}')
@@ -1117,6 +1550,17 @@ def update_admin_order_status(order_id):
 
 
 
+@api_bp.route('/admin/http-metrics')
+@login_required
+def admin_http_metrics():
+    """Latency and error counters of the outbound Strava, Printful and Stripe clients (this worker only)."""
+    user = User.query.get(session['user_id'])
+    if not user.is_admin:
+        return jsonify({'error': 'Forbidden'}), 403
+    metrics = http_metrics()
+    metrics['strava']['rate_limit'] = strava_api.stats()
+    return jsonify(metrics)
+
 @api_bp.route('/admin/designs')
 @login_required
 def admin_designs():
@@ -3,6 +3,7 @@ from flask import Blueprint, redirect, request, session, jsonify, current_app, u
 from models import User
 from extensions import db
 from flask_login import login_user
+from utils.http_clients import strava
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
 
@@ -125,7 +126,7 @@ def strava_callback():
         'grant_type': 'authorization_code'
     }
     try:
-        token_response = requests.post(token_url, data=payload)
+        token_response = strava.post(token_url, data=payload)
         token_response.raise_for_status()
         token_data = token_response.json()
     except requests.exceptions.RequestException as e:
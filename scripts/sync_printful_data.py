@@ -1,9 +1,10 @@
 import os
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-import requests
 from app import create_app, db
+from extensions import catalog_snapshot
 from models import Product, Variant
+from utils.http_clients import printful
 from dotenv import load_dotenv
 
 load_dotenv(override=True)
@@ -20,7 +21,7 @@ def sync():
         for p in products:
             print(f"Syncing Product {p.id} (Printful ID {p.printful_product_id})...")
             try:
-                res = requests.get(f'https://api.printful.com/products/{p.printful_product_id}', headers=headers)
+                res = printful.get(f'https://api.printful.com/products/{p.printful_product_id}', headers=headers)
                 res.raise_for_status()
                 data = res.json()
                 prod_data = data.get('result', {}).get('product', {})
@@ -36,7 +37,7 @@ def sync():
                 # --- Step 1.5: Get Store ID (Required for templates) ---
                 store_id = None
                 try:
-                    s_res = requests.get('https://api.printful.com/stores', headers=headers)
+                    s_res = printful.get('https://api.printful.com/stores', headers=headers)
                     if s_res.status_code == 200:
                         stores = s_res.json().get('result', [])
                         if stores:
@@ -56,7 +57,7 @@ def sync():
                     if store_id:
                         url += f'?store_id={store_id}'
                         
-                    tpl_res = requests.get(url, headers=headers)
+                    tpl_res = printful.get(url, headers=headers)
                     if tpl_res.status_code == 200:
                         tpl_data = tpl_res.json().get('result', {})
                         
@@ -177,6 +178,7 @@ def sync():
                 print(f"  -> Failed: {e}")
         
         db.session.commit()
+        catalog_snapshot.bump()  # workers drop their cached catalog responses
         print("Sync complete!")
 
 if __name__ == "__main__":
@@ -0,0 +1,80 @@
+"""
+Batch import of a mass start: different files that start in the same second
+must become separate activities, while re-uploading a file stays one.
+Runs with pytest or as a script; uses a throwaway SQLite database.
+"""
+import sys, os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('SECRET_KEY', 'test')
+
+import io
+import tempfile
+import time
+
+from config import Config
+
+WORK_DIR = tempfile.mkdtemp(prefix='miles-to-merch-test-')
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(WORK_DIR, 'test.db')
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    UPLOAD_SPOOL_DIR = os.path.join(WORK_DIR, 'uploads')
+    PARSE_CACHE_DIR = os.path.join(WORK_DIR, 'parse-cache')
+    DEM_DIR = None
+
+def gpx_file(runner):
+    """A short run starting at 07:00:00, its route offset per runner."""
+    points = ''.join(
+        f'<trkpt lat="{51.05 + i * 0.0001:.7f}" lon="{3.72 + runner * 0.001 + i * 0.00005:.7f}">'
+        f'<ele>10</ele><time>2024-05-01T07:{i // 60:02d}:{i % 60:02d}Z</time></trkpt>'
+        for i in range(120)
+    )
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<gpx version="1.1" creator="test" xmlns="http://www.topografix.com/GPX/1/1">'
+            f'<trk><name>Runner {runner}</name><trkseg>{points}</trkseg></trk></gpx>').encode('utf-8')
+
+def upload_batch(client, files):
+    response = client.post('/api/activities/upload-batch', data={
+        'files': [(io.BytesIO(body), name) for name, body in files]
+    })
+    assert response.status_code == 202, response.get_json()
+    status_url = response.get_json()['status_url']
+    for _ in range(300):
+        response = client.get(status_url)
+        if response.status_code != 202:
+            return response.get_json()
+        time.sleep(0.1)
+    raise AssertionError('batch did not finish')
+
+def test_same_start_second_gives_separate_activities():
+    from app import create_app
+    from extensions import db
+    from models import User, Activity
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        user = User(strava_id=1)
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s['user_id'] = user_id
+
+    files = [(f'runner{runner}.gpx', gpx_file(runner)) for runner in range(2)]
+    batch = upload_batch(client, files)
+    assert [entry['status'] for entry in batch['files']] == ['done', 'done'], batch
+    local_ids = {entry['local_id'] for entry in batch['files']}
+    assert len(local_ids) == 2, batch
+
+    # The same file again is the same activity, not a third one
+    batch = upload_batch(client, files[:1])
+    assert batch['files'][0]['local_id'] in local_ids, batch
+    with app.app_context():
+        assert Activity.query.filter_by(user_id=user_id).count() == 2
+
+if __name__ == '__main__':
+    test_same_start_second_gives_separate_activities()
+    print("OK: files with the same start second are stored separately")
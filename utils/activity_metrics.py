@@ -0,0 +1,203 @@
+import numpy as np
+
+EARTH_RADIUS = 6371000  # meters
+
+ELEVATION_WINDOW = 50.0    # meters of track averaged into the smoothed elevation
+ELEVATION_THRESHOLD = 2.0  # meters a climb or descent must reach before it counts
+
+# Stop detection per sport: below min_speed (m/s, averaged over `window`
+# seconds) or across a recording gap longer than max_gap seconds counts as stopped
+MOVING_THRESHOLDS = {
+    'Run': {'min_speed': 0.8, 'max_gap': 10, 'window': 5},
+    'Walk': {'min_speed': 0.4, 'max_gap': 15, 'window': 5},
+    'Hike': {'min_speed': 0.3, 'max_gap': 15, 'window': 10},
+    'Ride': {'min_speed': 1.0, 'max_gap': 10, 'window': 5},
+    'Swim': {'min_speed': 0.2, 'max_gap': 20, 'window': 10},
+}
+DEFAULT_MOVING_THRESHOLDS = MOVING_THRESHOLDS['Run']
+
+def haversine_distances(lat, lon):
+    """Distance in meters between every pair of consecutive points."""
+    phi = np.radians(lat)
+    delta_phi = np.radians(np.diff(lat))
+    delta_lambda = np.radians(np.diff(lon))
+    a = np.sin(delta_phi / 2)**2 + np.cos(phi[:-1]) * np.cos(phi[1:]) * np.sin(delta_lambda / 2)**2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return EARTH_RADIUS * c
+
+def _running_total(values):
+    # cumsum adds left to right, so totals match a plain Python loop bit for bit
+    # (np.sum uses pairwise summation and would differ in the last digits)
+    if not values.size:
+        return 0
+    return np.cumsum(values)[-1].item()
+
+def _max_and_mean(values):
+    """Max and mean of a sensor column where 0 means 'no reading'."""
+    if values is None:
+        return 0, None
+    present = values[values != 0]
+    if not present.size:
+        return 0, None
+    return present.max().item(), _running_total(present) / present.size
+
+def fill_gaps(values, x):
+    """Linearly interpolates NaN gaps over x; leading/trailing gaps take the nearest reading."""
+    valid = ~np.isnan(values)
+    if valid.all() or not valid.any():
+        return values
+    return np.interp(x, x[valid], values[valid])
+
+def smooth_elevation(ele, distance, window=ELEVATION_WINDOW):
+    """
+    Moving average of elevation over `window` meters of track, plus the
+    grade (percent) across the same window. The window bounds come from a
+    binary search on the cumulative distance and the sums from a prefix sum,
+    so uneven point spacing needs no loop.
+    """
+    lo = np.searchsorted(distance, distance - window / 2, side='left')
+    hi = np.searchsorted(distance, distance + window / 2, side='right') - 1
+    prefix = np.concatenate(([0.0], np.cumsum(ele)))
+    smooth = (prefix[hi + 1] - prefix[lo]) / (hi - lo + 1)
+
+    span = distance[hi] - distance[lo]
+    grade = np.divide(smooth[hi] - smooth[lo], span, out=np.zeros(span.size), where=span > 0) * 100
+    return smooth, grade
+
+def hysteresis_gain_loss(ele, threshold=ELEVATION_THRESHOLD):
+    """
+    Total climb and descent, counting a change of direction only once it
+    exceeds `threshold`. Only the local extremes are walked, which after
+    smoothing are a small fraction of the points.
+    """
+    step = np.sign(np.diff(ele))
+    moving = np.flatnonzero(step)
+    if not moving.size:
+        return 0.0, 0.0
+    turns = moving[np.flatnonzero(step[moving][1:] != step[moving][:-1]) + 1]
+    extremes = ele[np.concatenate(([0], turns, [ele.size - 1]))].tolist()
+
+    gain = loss = 0.0
+    pivot = extreme = extremes[0]
+    direction = 0
+    for value in extremes[1:]:
+        if direction == 0:
+            if abs(value - pivot) >= threshold:
+                direction = 1 if value > pivot else -1
+                extreme = value
+        elif (value - extreme) * direction > 0:
+            extreme = value  # trend continues
+        elif abs(value - extreme) >= threshold:
+            # Confirmed turn: the trend up to `extreme` counts in full
+            if direction > 0:
+                gain += extreme - pivot
+            else:
+                loss += pivot - extreme
+            pivot, extreme, direction = extreme, value, -direction
+    if direction > 0:
+        gain += extreme - pivot
+    elif direction < 0:
+        loss += pivot - extreme
+    return gain, loss
+
+def detect_moving(time, distance, sport_type='Run', thresholds=None):
+    """
+    Strava-style `moving` stream: True where the segment ending at a point
+    was spent moving. Speed is taken over the last few seconds (one binary
+    search on the time stream for the window starts), so GPS jitter while
+    standing still does not count as movement. Returns (moving, moving_time).
+    """
+    limits = dict(MOVING_THRESHOLDS.get(sport_type, DEFAULT_MOVING_THRESHOLDS), **(thresholds or {}))
+    moving = np.zeros(time.size, dtype=bool)
+    if time.size < 2:
+        return moving, 0
+
+    start = np.searchsorted(time, time - limits['window'], side='left')
+    start = np.minimum(start, np.arange(time.size) - 1)
+    start[0] = 0
+    span = time - time[start]
+    speed = np.divide(distance - distance[start], span, out=np.zeros(time.size), where=span > 0)
+
+    dt = np.diff(time, prepend=time[0])
+    # A gap longer than max_gap (auto-pause, sparse recording) counts as
+    # moving only if the distance covered over the gap itself keeps up min_speed
+    gap_speed = np.divide(np.diff(distance, prepend=distance[0]), dt, out=np.zeros(time.size), where=dt > 0)
+    speed = np.where(dt > limits['max_gap'], gap_speed, speed)
+    moving = (dt > 0) & (speed >= limits['min_speed'])
+    moving[0] = False
+    moving_time = int(round(_running_total(dt[moving]))) if moving.any() else 0
+    return moving, moving_time
+
+def compute_activity_metrics(lat, lon, ele, time, heartrate=None, cadence=None, watts=None,
+                             sport_type='Run'):
+    """
+    Computes the Strava-style summary fields and cumulative streams of a track
+    in one batched pass over columnar arrays.
+
+    lat, lon, ele and time (seconds since the first point) must have the same
+    length. Missing elevations are NaN; they are filled along the track for
+    the gain/loss and grade_smooth (None without any elevation). The optional
+    sensor columns use 0 for 'no reading', like the GPX extensions do.
+    Moving time uses the stop thresholds of `sport_type`.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    ele = np.asarray(ele, dtype=np.float64)
+    time = np.asarray(time, dtype=np.float64)
+
+    # Distance
+    dist_inc = haversine_distances(lat, lon)
+    distance = np.empty(lat.size, dtype=np.float64)
+    if lat.size:
+        distance[0] = 0
+        np.cumsum(dist_inc, out=distance[1:])
+    total_distance = distance[-1].item() if dist_inc.size else 0
+
+    # Elevation: gaps filled along the track, smoothed, gain/loss with hysteresis
+    has_elevation = bool(np.any(~np.isnan(ele)))
+    if has_elevation:
+        filled = fill_gaps(ele, distance)
+        smooth, grade = smooth_elevation(filled, distance)
+        total_elevation_gain, total_elevation_loss = hysteresis_gain_loss(smooth)
+        elev_high = np.nanmax(ele).item()
+        elev_low = np.nanmin(ele).item()
+    else:
+        grade = None
+        total_elevation_gain = total_elevation_loss = 0
+        elev_high = elev_low = None
+
+    # Instantaneous speed, skipping points without a time step
+    time_diff = np.diff(time)
+    has_step = time_diff > 0
+    speeds = dist_inc[has_step] / time_diff[has_step]
+    max_speed = max(0, speeds.max().item()) if speeds.size else 0
+
+    max_hr, avg_hr = _max_and_mean(None if heartrate is None else np.asarray(heartrate))
+    max_cadence, avg_cadence = _max_and_mean(None if cadence is None else np.asarray(cadence))
+    max_watts, avg_watts = _max_and_mean(None if watts is None else np.asarray(watts, dtype=np.float64))
+
+    elapsed_time = int(time[-1] - time[0]) if time.size else 0
+    moving, moving_time = detect_moving(time, distance, sport_type)
+
+    return {
+        'distance': total_distance,
+        'elapsed_time': elapsed_time,
+        'moving_time': moving_time,
+        'total_elevation_gain': total_elevation_gain,
+        'total_elevation_loss': total_elevation_loss,
+        'elev_high': elev_high,
+        'elev_low': elev_low,
+        'max_speed': max_speed,
+        'average_heartrate': avg_hr,
+        'max_heartrate': max_hr,
+        'average_cadence': avg_cadence,
+        'max_cadence': max_cadence,
+        'average_watts': avg_watts,
+        'max_watts': max_watts,
+        'streams': {
+            'distance': distance,
+            'time': time - time[0] if time.size else time,
+            'grade_smooth': grade,
+            'moving': moving,
+        }
+    }
@@ -0,0 +1,61 @@
+import os
+from utils.gpx_parser import parse_gpx_to_strava_format
+from utils.tcx_parser import parse_tcx_to_strava_format
+from utils.fit_parser import parse_fit_to_strava_format
+
+SNIFF_BYTES = 4096
+ACTIVITY_EXTENSIONS = ('.gpx', '.tcx', '.fit')
+
+PARSERS = {
+    'gpx': parse_gpx_to_strava_format,
+    'tcx': parse_tcx_to_strava_format,
+    'fit': parse_fit_to_strava_format,
+}
+
+class _PrefixedStream:
+    """Replays the sniffed bytes before the rest of the stream, for streams that can't seek."""
+
+    def __init__(self, head, stream):
+        self.head = head
+        self.stream = stream
+
+    def read(self, size=-1):
+        if not self.head:
+            return self.stream.read(size)
+        if size is None or size < 0:
+            data, self.head = self.head + self.stream.read(), b''
+            return data
+        data, self.head = self.head[:size], self.head[size:]
+        if len(data) < size:
+            data += self.stream.read(size - len(data))
+        return data
+
+def is_activity_file_name(name):
+    """True for GPX/TCX/FIT names, skipping the resource forks macOS adds to ZIPs."""
+    base = os.path.basename(name)
+    return name.lower().endswith(ACTIVITY_EXTENSIONS) and not base.startswith('._') \
+        and not name.startswith('__MACOSX/')
+
+def detect_format(head):
+    """'fit', 'tcx' or 'gpx' from the first bytes of a file. Anything else is tried as GPX."""
+    if len(head) >= 12 and head[8:12] == b'.FIT':
+        return 'fit'
+    if b'<TrainingCenterDatabase' in head:
+        return 'tcx'
+    return 'gpx'
+
+def parse_activity_file(file_stream, dem=None, digest=None):
+    """
+    Parses a GPX, TCX or FIT upload, picked by content rather than file name,
+    into the Strava-shaped dict of parse_gpx_to_strava_format. Returns None
+    when the file holds no track; malformed files raise.
+
+    digest (the sha256 of the file) goes into the id, so different files
+    starting in the same second, as at a mass start, are stored apart.
+    """
+    head = file_stream.read(SNIFF_BYTES)
+    parser = PARSERS[detect_format(head)]
+    activity_data = parser(_PrefixedStream(head, file_stream), dem=dem)
+    if activity_data and digest:
+        activity_data['id'] = f"{activity_data['id']}_{digest[:16]}"
+    return activity_data
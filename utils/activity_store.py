@@ -0,0 +1,180 @@
+import numpy as np
+from datetime import datetime
+from sqlalchemy.orm import joinedload
+from extensions import db, strava_api
+from models import Activity
+from utils.strava_scheduler import INTERACTIVE, BACKGROUND, StravaRateLimited
+
+SYNC_PAGE_SIZE = 200
+
+def load_activity(user_id, source, external_id):
+    """
+    The stored activity with all its streams, in one indexed read. Returns
+    None when there is no copy, only the list summary was synced, or the
+    streams are a simplified (print) copy that can't stand in for the
+    full-resolution activity.
+    """
+    activity = (Activity.query
+                .options(joinedload(Activity.streams))
+                .filter_by(user_id=user_id, source=source, external_id=str(external_id))
+                .first())
+    if activity is None or not activity.streams:
+        return None
+    if any(stream.resolution == 'print' for stream in activity.streams):
+        return None
+    return activity
+
+def _get_or_create(user_id, source, external_id):
+    activity = Activity.query.filter_by(user_id=user_id, source=source, external_id=str(external_id)).first()
+    if activity is None:
+        activity = Activity(user_id=user_id, source=source, external_id=str(external_id))
+        db.session.add(activity)
+    return activity
+
+def save_strava_activity(user_id, activity_id, details, streams, photos=None):
+    """Stores (or refreshes) a Strava activity from its API payloads."""
+    activity = _get_or_create(user_id, 'strava', activity_id)
+    activity.set_summary(details)
+    activity.photos = photos or []
+    for stream_type, stream in (streams or {}).items():
+        data = stream.get('data') or []
+        if not data:
+            continue
+        # None (sensor dropout) becomes NaN and ends up in the validity mask
+        values = np.array(data, dtype=np.float64)
+        activity.set_stream(stream_type, values,
+                            series_type=stream.get('series_type'), resolution=stream.get('resolution'))
+    db.session.commit()
+    return activity
+
+def save_gpx_activity(user_id, activity_data):
+    """Stores a parsed GPX/TCX/FIT upload; its 'streams' is an ActivityStreams container."""
+    streams = activity_data['streams']
+    activity = _get_or_create(user_id, activity_data.get('source', 'gpx'), activity_data['id'])
+    activity.set_summary({k: v for k, v in activity_data.items() if k != 'streams'})
+    activity.photos = []
+    for stream_type in streams.keys():
+        activity.set_stream(stream_type, streams.get(stream_type), valid=streams.valid(stream_type))
+    db.session.commit()
+    return activity
+
+def save_upload_job(state, activity_data):
+    """UploadJobs.on_done: stores a parsed upload for the user who queued it."""
+    try:
+        stored = save_gpx_activity(state['user_id'], activity_data)
+        return {'local_id': stored.id}
+    except Exception as e:
+        db.session.rollback()
+        print(f"Could not store uploaded activity: {e}")
+        return {}
+
+def find_activity(user_id, source, external_id):
+    return Activity.query.filter_by(user_id=user_id, source=source, external_id=str(external_id)).first()
+
+def forget_activity_detail(user_id, source, external_id):
+    """
+    Drops the stored streams and photos of an activity but keeps its list
+    summary, so it stays listed and the next open refetches the detail.
+    """
+    activity = find_activity(user_id, source, external_id)
+    if activity:
+        activity.streams = []
+        activity.photos = []
+        db.session.commit()
+
+def delete_activity(user_id, source, external_id):
+    activity = find_activity(user_id, source, external_id)
+    if activity:
+        db.session.delete(activity)
+        db.session.commit()
+
+def _start_epoch(summary):
+    start_date = summary.get('start_date')
+    if not start_date:
+        return 0
+    return int(datetime.fromisoformat(start_date.replace('Z', '+00:00')).timestamp())
+
+ACTIVITIES_URL = 'https://www.strava.com/api/v3/athlete/activities'
+
+def _fetch_activity_page(user, params, priority):
+    response = strava_api.get(ACTIVITIES_URL, headers={'Authorization': f'Bearer {user.access_token}'},
+                              params=dict(params, per_page=SYNC_PAGE_SIZE), priority=priority)
+    response.raise_for_status()
+    return response.json()
+
+def _store_activity_page(user, batch):
+    """Adds the summaries we don't have yet; returns how many were added."""
+    ids = [str(summary['id']) for summary in batch]
+    known = {row.external_id for row in Activity.query
+             .with_entities(Activity.external_id)
+             .filter(Activity.user_id == user.id, Activity.source == 'strava', Activity.external_id.in_(ids))}
+    added = 0
+    for summary in batch:
+        if str(summary['id']) in known:
+            continue
+        activity = Activity(user_id=user.id, source='strava', external_id=str(summary['id']))
+        activity.set_summary(summary)
+        db.session.add(activity)
+        added += 1
+    return added
+
+def sync_strava_activities(user):
+    """
+    The request-path part of a sync: one Strava call. The first sync fetches
+    the newest page; later ones the activities newer than the high-water
+    mark. Returns (added, more), more meaning there are further new pages or
+    older history left for sync_strava_background.
+    """
+    first_sync = user.strava_synced_until is None
+    if first_sync:
+        # Without 'after' Strava returns the newest activities first
+        batch = _fetch_activity_page(user, {}, INTERACTIVE)
+    else:
+        # With 'after' it returns the oldest first, so the mark can move page by page
+        batch = _fetch_activity_page(user, {'after': user.strava_synced_until}, INTERACTIVE)
+
+    added = _store_activity_page(user, batch)
+    starts = [_start_epoch(s) for s in batch]
+    user.strava_synced_until = max([user.strava_synced_until or 0] + starts)
+    if first_sync and len(batch) == SYNC_PAGE_SIZE:
+        user.strava_backfill_before = min(starts)
+    db.session.commit()
+    return added, len(batch) == SYNC_PAGE_SIZE or bool(user.strava_backfill_before)
+
+def sync_strava_background(user):
+    """
+    The rest of a sync, off the request path and at background priority:
+    remaining new pages, then older history with 'before'. Stops when the
+    calls get shed; the next sync resumes from the stored marks.
+    Returns the number of activities added.
+    """
+    added = 0
+    try:
+        while True:
+            batch = _fetch_activity_page(user, {'after': user.strava_synced_until or 0}, BACKGROUND)
+            added += _store_activity_page(user, batch)
+            user.strava_synced_until = max([user.strava_synced_until or 0] + [_start_epoch(s) for s in batch])
+            db.session.commit()
+            if len(batch) < SYNC_PAGE_SIZE:
+                break
+
+        while user.strava_backfill_before:
+            batch = _fetch_activity_page(user, {'before': user.strava_backfill_before}, BACKGROUND)
+            added += _store_activity_page(user, batch)
+            user.strava_backfill_before = min(_start_epoch(s) for s in batch) \
+                if len(batch) == SYNC_PAGE_SIZE else None
+            db.session.commit()
+    except StravaRateLimited as e:
+        db.session.rollback()
+        print(f"Deferring rest of Strava sync for user {user.id}: {e}")
+    return added
+
+def list_strava_activities(user_id, page=1, per_page=SYNC_PAGE_SIZE):
+    """One page of a user's stored Strava activities, newest first."""
+    rows = (Activity.query
+            .filter_by(user_id=user_id, source='strava')
+            .order_by(Activity.start_date.desc())
+            .offset((page - 1) * per_page)
+            .limit(per_page)
+            .all())
+    return [row.to_summary_dict() for row in rows]
@@ -0,0 +1,161 @@
+import json
+import struct
+import numpy as np
+
+# Column types; everything not listed is stored as float32
+STREAM_DTYPES = {
+    'latlng': np.float64,
+    'time': np.float64,
+    'heartrate': np.int32,
+    'cadence': np.int32,
+    'moving': np.bool_,
+}
+
+# Decimals kept when a float stream is written as JSON. float32 noise like
+# 6.663485527038574 only costs bytes, nobody prints altitude to the micrometer.
+JSON_DECIMALS = {
+    'latlng': 7,
+    'time': 3,
+    'distance': 2,
+    'altitude': 2,
+    'velocity_smooth': 3,
+    'grade_smooth': 2,
+    'watts': 1,
+    'temp': 1,
+}
+
+BINARY_MAGIC = b'AST1'
+
+class ActivityStreams:
+    """
+    Array-backed container for the streams of one activity.
+
+    Every stream is a typed numpy column of the same length (latlng is an
+    (n, 2) column). Streams with gaps, like heartrate on a watch that lost
+    the strap, keep a packed validity bitmask next to the values instead of
+    a list full of None objects.
+    """
+
+    def __init__(self, length):
+        self.length = length
+        self._columns = {}
+        self._masks = {}
+
+    def set(self, name, values, valid=None):
+        dtype = STREAM_DTYPES.get(name, np.float32)
+        values = np.asarray(values, dtype=dtype)
+        if len(values) != self.length:
+            raise ValueError(f"Stream '{name}' has {len(values)} points, expected {self.length}")
+        if valid is None and np.issubdtype(dtype, np.floating):
+            valid = ~np.isnan(values) if values.ndim == 1 else ~np.isnan(values).any(axis=1)
+        self._columns[name] = values
+        self._masks.pop(name, None)
+        if valid is not None:
+            valid = np.asarray(valid, dtype=bool)
+            if not valid.all():
+                self._masks[name] = np.packbits(valid, bitorder='little')
+
+    def get(self, name):
+        return self._columns[name]
+
+    def valid(self, name):
+        """Boolean array telling which points of a stream hold a real value."""
+        if name not in self._masks:
+            return np.ones(self.length, dtype=bool)
+        return np.unpackbits(self._masks[name], count=self.length, bitorder='little').astype(bool)
+
+    def take(self, indices):
+        """New container holding only the given points of every stream."""
+        taken = ActivityStreams(len(indices))
+        for name, values in self._columns.items():
+            taken._columns[name] = values[indices]
+            if name in self._masks:
+                valid = self.valid(name)[indices]
+                if not valid.all():
+                    taken._masks[name] = np.packbits(valid, bitorder='little')
+        return taken
+
+    def float_values(self, name):
+        """Stream as float64 with NaN in the gaps, handy for numeric work."""
+        values = self._columns[name].astype(np.float64)
+        if name in self._masks:
+            values[~self.valid(name)] = np.nan
+        return values
+
+    def keys(self):
+        return self._columns.keys()
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    def __len__(self):
+        return self.length
+
+    def _stream_to_list(self, name):
+        values = self._columns[name]
+        decimals = JSON_DECIMALS.get(name)
+        if decimals is not None:
+            values = np.round(values.astype(np.float64), decimals)
+        if name not in self._masks:
+            return values.tolist()
+        # Gaps become None, like the Strava API does
+        with_gaps = values.astype(object)
+        with_gaps[~self.valid(name)] = None
+        return with_gaps.tolist()
+
+    def to_dict(self):
+        """Strava-shaped dict of plain lists, ready for jsonify."""
+        return {name: self._stream_to_list(name) for name in self._columns}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), separators=(',', ':'))
+
+    def to_bytes(self, meta=None):
+        """
+        Compact binary form: magic, header length, a JSON header describing
+        the columns (plus optional meta), then the raw little-endian buffers.
+        """
+        columns = []
+        buffers = []
+        offset = 0
+        for name, values in self._columns.items():
+            data = values.astype(values.dtype.newbyteorder('<'), copy=False).tobytes()
+            entry = {
+                'name': name,
+                'dtype': values.dtype.str.lstrip('<>|='),
+                'shape': list(values.shape),
+                'offset': offset,
+                'nbytes': len(data),
+            }
+            buffers.append(data)
+            offset += len(data)
+            if name in self._masks:
+                mask = self._masks[name].tobytes()
+                entry['mask_offset'] = offset
+                entry['mask_nbytes'] = len(mask)
+                buffers.append(mask)
+                offset += len(mask)
+            columns.append(entry)
+
+        header = json.dumps({'length': self.length, 'columns': columns, 'meta': meta},
+                            separators=(',', ':')).encode('utf-8')
+        return BINARY_MAGIC + struct.pack('<I', len(header)) + header + b''.join(buffers)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Reverse of to_bytes, returns (streams, meta)."""
+        if data[:4] != BINARY_MAGIC:
+            raise ValueError("Not an ActivityStreams buffer")
+        header_length = struct.unpack('<I', data[4:8])[0]
+        header = json.loads(data[8:8 + header_length].decode('utf-8'))
+        body = memoryview(data)[8 + header_length:]
+
+        streams = cls(header['length'])
+        for entry in header['columns']:
+            raw = body[entry['offset']:entry['offset'] + entry['nbytes']]
+            values = np.frombuffer(raw, dtype='<' + entry['dtype']).reshape(entry['shape'])
+            streams._columns[entry['name']] = values.astype(values.dtype.newbyteorder('='))
+            if 'mask_offset' in entry:
+                mask = body[entry['mask_offset']:entry['mask_offset'] + entry['mask_nbytes']]
+                streams._masks[entry['name']] = np.frombuffer(mask, dtype=np.uint8).copy()
+        return streams, header.get('meta')
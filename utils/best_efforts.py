@@ -0,0 +1,136 @@
+import numpy as np
+
+# Same names Strava uses for its precomputed run efforts
+BEST_EFFORT_DISTANCES = (
+    ('400m', 400),
+    ('1K', 1000),
+    ('5K', 5000),
+    ('10K', 10000),
+    ('Half-Marathon', 21097.5),
+    ('Marathon', 42195),
+)
+
+# Peak power durations in seconds
+POWER_DURATIONS = (5, 10, 30, 60, 300, 600, 1200, 1800, 3600)
+
+RUN_TYPES = ('Run', 'TrailRun', 'VirtualRun')
+
+# Samples further apart than this are a pause, they add no energy to the power curve
+MAX_POWER_GAP = 10
+
+def _duration_label(seconds):
+    if seconds < 60:
+        return f'{seconds}s'
+    if seconds < 3600:
+        return f'{seconds // 60}min'
+    return f'{seconds // 3600}h'
+
+# Resampling steps. Every window becomes a fixed offset on these grids, so
+# the sliding window is one vectorized subtraction per effort. Grids are
+# coarsened to at most twice the number of samples, which the track cannot
+# resolve any finer anyway.
+DISTANCE_STEP = 1.0  # meters
+TIME_STEP = 1.0      # seconds
+
+def _grid(start, stop, step, samples):
+    step = max(step, (stop - start) / (2 * samples))
+    return np.arange(start, stop + step / 2, step), step
+
+def fastest_efforts(time, distance, efforts=BEST_EFFORT_DISTANCES):
+    """
+    Fastest time over each effort distance. Time is interpolated onto a (1 m)
+    distance grid, so an effort can start and end between two samples.
+    """
+    if distance.size < 2:
+        return []
+    grid, step = _grid(distance[0], distance[-1], DISTANCE_STEP, distance.size)
+    time_at = np.interp(grid, distance, time)
+
+    results = []
+    for name, span in efforts:
+        offset = int(round(span / step))
+        if offset >= grid.size:
+            break
+        # Window [k, k + offset] slides along the grid
+        elapsed = time_at[offset:] - time_at[:-offset]
+        best = int(elapsed.argmin())
+        results.append({
+            'name': name,
+            'distance': span,
+            'elapsed_time': int(round(elapsed[best].item())),
+            'moving_time': int(round(elapsed[best].item())),
+            'start_index': int(np.searchsorted(distance, grid[best], side='right') - 1),
+            'end_index': int(min(np.searchsorted(distance, grid[best + offset]), distance.size - 1)),
+            'pr_rank': None,
+        })
+    return results
+
+def power_curve(time, watts, durations=POWER_DURATIONS):
+    """
+    Peak average power over each duration, from a prefix sum of energy
+    resampled to (at least) 1 s. Each sample's power counts for the time since the
+    previous sample.
+    """
+    if time.size < 2:
+        return []
+    dt = np.diff(time, prepend=time[0])
+    dt[dt > MAX_POWER_GAP] = 0
+    energy = np.cumsum(np.nan_to_num(watts) * dt)
+    grid, step = _grid(time[0], time[-1], TIME_STEP, time.size)
+    energy_at = np.interp(grid, time, energy)
+
+    results = []
+    for seconds in durations:
+        offset = int(round(seconds / step))
+        if offset >= grid.size:
+            break
+        average = (energy_at[offset:] - energy_at[:-offset]) / (offset * step)
+        best = int(average.argmax())
+        results.append({
+            'name': f'{_duration_label(seconds)} Power',
+            'elapsed_time': seconds,
+            'average_watts': round(average[best].item(), 1),
+            'start_index': int(np.searchsorted(time, grid[best], side='right') - 1),
+            'end_index': int(min(np.searchsorted(time, grid[best + offset]), time.size - 1)),
+            'pr_rank': None,
+        })
+    return results
+
+def compute_best_efforts(time, distance=None, watts=None, sport_type='Run'):
+    """
+    Best efforts in Strava's best_efforts shape: fastest standard distances
+    for runs, plus a peak power curve when there is a watts stream. Points
+    without a time (or distance) reading are left out.
+    """
+    time = np.asarray(time, dtype=np.float64)
+    if not time.size:
+        return []
+    keep = ~np.isnan(time)
+    if distance is not None:
+        distance = np.asarray(distance, dtype=np.float64)
+        if distance.size != time.size:
+            distance = None
+        else:
+            keep &= ~np.isnan(distance)
+
+    efforts = []
+    if distance is not None and sport_type in RUN_TYPES:
+        efforts += fastest_efforts(time[keep], distance[keep])
+    if watts is not None:
+        watts = np.asarray(watts, dtype=np.float64)
+        if watts.size == time.size and np.nanmax(watts, initial=0) > 0:
+            efforts += power_curve(time[keep], watts[keep])
+
+    # Indices back into the full streams
+    if not keep.all():
+        kept = np.flatnonzero(keep)
+        for effort in efforts:
+            effort['start_index'] = int(kept[effort['start_index']])
+            effort['end_index'] = int(kept[effort['end_index']])
+    return efforts
+
+def merge_best_efforts(existing, computed):
+    """Keeps Strava's own efforts (they carry PR ranks) and adds the computed ones it lacks."""
+    existing = list(existing or [])
+    names = {effort.get('name') for effort in existing}
+    return existing + [effort for effort in computed if effort['name'] not in names]
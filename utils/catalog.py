@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from flask import current_app
+from sqlalchemy.orm import selectinload
+from extensions import db, catalog_snapshot
+from models import Product, Variant
+from utils.shared_files import write_atomic, lock_file
+
+MANIFEST_NAME = 'manifest.json'
+PUBLISH_KEEP_SECONDS = 3600  # superseded files stay this long for clients holding an older manifest
+_publish_lock = threading.Lock()
+
+def dumps(payload):
+    """Catalog payload as the exact bytes the API serves (compact, sorted keys)."""
+    return current_app.json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+def load_catalog(include_inactive=False):
+    """
+    Product dicts (as Product.to_dict) for the whole catalog in three queries:
+    products, their variants and their print areas, whatever the catalog size.
+    Without include_inactive, products without an active variant are left
+    out in SQL instead of being serialized and dropped.
+    """
+    product_query = Product.query.options(selectinload(Product.print_areas))
+    if not include_inactive:
+        has_active_variant = db.session.query(Variant.id).filter(
+            Variant.product_id == Product.id, Variant.is_active.is_(True)).exists()
+        product_query = product_query.filter(has_active_variant)
+
+    variants_by_product = _variants_by_product(include_inactive)
+    return [
+        product.to_dict(include_inactive, variants=variants_by_product.get(product.id, []))
+        for product in product_query.order_by(Product.id)
+    ]
+
+def _variants_by_product(include_inactive=False, product_ids=None):
+    """product id -> its variants, in one query."""
+    query = Variant.query
+    if not include_inactive:
+        query = query.filter(Variant.is_active.is_(True))
+    if product_ids is not None:
+        query = query.filter(Variant.product_id.in_(product_ids))
+    variants_by_product = defaultdict(list)
+    for variant in query.order_by(Variant.product_id, Variant.id):
+        variants_by_product[variant.product_id].append(variant)
+    return variants_by_product
+
+def product_detail(product, variants=None):
+    """Payload of /api/products/<id>; variants: preloaded active variants."""
+    # Compact variant data (no print_areas) for fast product detail page loading.
+    # The design editor fetches print_areas separately when needed.
+    variants_list = variants if variants is not None else product.variants.filter_by(is_active=True).all()
+    compact_variants = [{
+        'id': v.id,
+        'printful_variant_id': v.printful_variant_id,
+        'product_name': product.name,
+        'color': v.color,
+        'color_code': v.color_code,
+        'size': v.size,
+        'price': v.price,
+        'printful_price': v.printful_price,
+        'in_stock': v.in_stock,
+        'merch_color_type': v.merch_color_type,
+        'image': v.image,
+        'image_urls': v.image_urls,
+        'image_base_path': v.image_base_path,
+        'available_regions': v.available_regions,
+        # print_areas omitted intentionally — fetched separately by the design editor
+    } for v in variants_list]
+    return {
+        'id': product.id,
+        'name': product.name,
+        'description': product.description,
+        'printful_product_id': product.printful_product_id,
+        'printful_name': product.printful_name,
+        'product_image_url': product.product_image_url,
+        'sponsored_settings': getattr(product, 'sponsored_settings', {}) or {},
+        'print_areas': {p.placement: p.to_dict() for p in product.print_areas},
+        'variants': compact_variants,
+    }
+
+# --- Static publishing ---
+
+def publish_catalog(directory, product_ids=None):
+    """
+    Renders the /api/products payload and the /api/products/<id> payloads to
+    static JSON files named after a hash of their content, plus a
+    manifest.json pointing at the current files and the catalog version.
+    With product_ids only those products (and the list) are re-rendered,
+    the rest of the manifest is kept. Returns the manifest.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with _publish_lock, open(os.path.join(directory, '.publish.lock'), 'a') as lock:
+        lock_file(lock)  # one publisher at a time across workers
+
+        manifest = _read_manifest(directory) if product_ids is not None else None
+        if manifest is None:
+            manifest = {'products': None, 'product': {}}
+            product_ids = None
+        product_files = dict(manifest['product'])
+
+        query = Product.query.options(selectinload(Product.print_areas))
+        if product_ids is not None:
+            product_ids = {int(product_id) for product_id in product_ids}
+            query = query.filter(Product.id.in_(product_ids))
+            for product_id in product_ids:
+                product_files.pop(str(product_id), None)  # deleted ones stay out
+        variants_by_product = _variants_by_product(product_ids=product_ids)
+        for product in query:
+            payload = product_detail(product, variants_by_product.get(product.id, []))
+            product_files[str(product.id)] = _write_hashed(directory, f'product-{product.id}', dumps(payload))
+
+        manifest = {
+            'version': catalog_snapshot.version(),
+            'published_at': datetime.now(timezone.utc).isoformat(),
+            'products': _write_hashed(directory, 'products', dumps(load_catalog())),
+            'product': dict(sorted(product_files.items(), key=lambda item: int(item[0]))),
+        }
+        write_atomic(os.path.join(directory, MANIFEST_NAME), json.dumps(manifest, indent=2).encode('utf-8'))
+        _prune_published(directory, manifest)
+    return manifest
+
+def _write_hashed(directory, stem, body):
+    name = f'{stem}.{hashlib.sha1(body).hexdigest()[:16]}.json'
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):  # same content, same name: nothing to write
+        write_atomic(path, body)
+    return name
+
+def _read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if isinstance(manifest.get('product'), dict) else None
+
+def _prune_published(directory, manifest):
+    """Removes hashed files the manifest no longer references, once they are old enough."""
+    current = {manifest['products'], *manifest['product'].values()}
+    cutoff = time.time() - PUBLISH_KEEP_SECONDS
+    for name in os.listdir(directory):
+        if name in current or not name.endswith('.json') or name == MANIFEST_NAME:
+            continue
+        if not (name.startswith('products.') or name.startswith('product-')):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
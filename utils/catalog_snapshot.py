@@ -0,0 +1,99 @@
+import hashlib
+import os
+import tempfile
+import threading
+
+from utils.shared_files import lock_file
+
+class CatalogSnapshot:
+    """
+    Pre-serialized catalog responses (/api/products and /api/products/<id>)
+    with their ETags, kept per worker and keyed by a catalog version.
+
+    The version is a counter in CATALOG_VERSION_FILE, shared by the workers
+    and the flask commands on the machine. Whatever changes the catalog
+    calls bump() after committing. Checking for a new version costs a stat()
+    per request; the snapshot is rebuilt lazily, one response at a time.
+    """
+
+    def __init__(self, app=None):
+        self.version_file = os.path.join(tempfile.gettempdir(), 'miles-to-merch-catalog-version')
+        self._signature = None  # (mtime_ns, size) of the version file when last read
+        self._version = 0
+        self._entries = {}  # key -> (body, etag), all built at self._version
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.version_file = app.config.get('CATALOG_VERSION_FILE') or self.version_file
+
+    # --- Version ---
+
+    def version(self):
+        """Current catalog version; drops the snapshot when another process bumped it."""
+        try:
+            st = os.stat(self.version_file)
+            signature = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            signature = None
+        if signature == self._signature:
+            return self._version
+
+        version = 0
+        if signature is not None:
+            try:
+                with open(self.version_file) as f:
+                    version = int(f.read())
+            except (OSError, ValueError):
+                return self._version  # caught mid-write, look again next request
+        with self._lock:
+            self._signature = signature
+            if version != self._version:
+                self._version = version
+                self._entries.clear()
+        return version
+
+    def bump(self):
+        """Marks the catalog as changed, for this worker and all others."""
+        with self._lock:
+            try:
+                with open(self.version_file, 'a+') as f:
+                    lock_file(f)
+                    f.seek(0)
+                    try:
+                        version = int(f.read() or 0) + 1
+                    except ValueError:
+                        version = 1
+                    f.seek(0)
+                    f.truncate()
+                    f.write(str(version))
+            except OSError as e:
+                print(f"CatalogSnapshot: could not write {self.version_file}: {e}")
+                version = self._version + 1
+            self._version = version
+            self._signature = None  # re-read (and re-stat) on the next request
+            self._entries.clear()
+        return version
+
+    # --- Responses ---
+
+    def get(self, key, build):
+        """
+        (body, etag) for key, serializing build() only when this version of the
+        catalog hasn't been built yet. The ETag is a hash of the body.
+        """
+        version = self.version()
+        entry = self._entries.get(key)
+        if entry is not None:
+            return entry
+
+        body = build()
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        entry = (body, hashlib.sha1(body).hexdigest())
+        with self._lock:
+            # A bump while building means the body may already be stale
+            if version == self._version:
+                self._entries[key] = entry
+        return entry
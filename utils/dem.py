@@ -0,0 +1,107 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+HGT_VOID = -32768
+# Samples per tile side for SRTM1 (1 arc second) and SRTM3 (3 arc seconds)
+HGT_SIZES = {3601 * 3601 * 2: 3601, 1201 * 1201 * 2: 1201}
+
+def tile_name(lat, lon):
+    """SRTM file name of the 1x1 degree tile whose south-west corner is (lat, lon)."""
+    return f"{'N' if lat >= 0 else 'S'}{abs(lat):02d}{'E' if lon >= 0 else 'W'}{abs(lon):03d}.hgt"
+
+class DemTiles:
+    """
+    Offline elevation lookups from SRTM .hgt tiles in DEM_DIR.
+
+    Tiles are opened lazily as read-only memory maps, so only the pages a
+    track touches are read from disk, and kept in a small per-worker LRU.
+    Without DEM_DIR (or for areas without a tile) lookups return NaN and the
+    GPS elevations are kept.
+    """
+
+    def __init__(self, app=None, max_tiles=32):
+        self.directory = None
+        self.max_tiles = max_tiles
+        self._tiles = OrderedDict()  # (lat, lon) -> memmap, or None when there is no tile
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.directory = app.config.get('DEM_DIR') or None
+        self.max_tiles = app.config.get('DEM_MAX_OPEN_TILES', self.max_tiles)
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def _tile(self, lat, lon):
+        key = (lat, lon)
+        with self._lock:
+            if key in self._tiles:
+                self._tiles.move_to_end(key)
+                return self._tiles[key]
+
+        tile = None
+        path = os.path.join(self.directory, tile_name(lat, lon))
+        try:
+            size = HGT_SIZES.get(os.path.getsize(path))
+            if size:
+                tile = np.memmap(path, dtype='>i2', mode='r', shape=(size, size))
+            else:
+                print(f"DEM: {path} is not an SRTM1/SRTM3 tile, ignoring it")
+        except OSError:
+            pass
+
+        with self._lock:
+            self._tiles[key] = tile
+            while len(self._tiles) > self.max_tiles:
+                self._tiles.popitem(last=False)
+        return tile
+
+    def sample(self, lat, lon):
+        """Bilinearly interpolated elevations (meters) for arrays of coordinates, NaN where unknown."""
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        result = np.full(lat.shape, np.nan)
+        if not self.enabled or not lat.size:
+            return result
+
+        tile_lats = np.floor(lat).astype(np.int64)
+        tile_lons = np.floor(lon).astype(np.int64)
+        # One integer per tile, so the grouping is a plain 1-D unique
+        keys = (tile_lats + 90) * 360 + (tile_lons + 180)
+        for key in np.unique(keys).tolist():
+            tile_lat, tile_lon = key // 360 - 90, key % 360 - 180
+            tile = self._tile(tile_lat, tile_lon)
+            if tile is None:
+                continue
+            points = keys == key
+            last = tile.shape[0] - 1
+            # Rows run north to south, columns west to east
+            row = (tile_lat + 1 - lat[points]) * last
+            col = (lon[points] - tile_lon) * last
+            r0 = np.clip(np.floor(row).astype(np.int64), 0, last - 1)
+            c0 = np.clip(np.floor(col).astype(np.int64), 0, last - 1)
+            fr = row - r0
+            fc = col - c0
+
+            v00 = tile[r0, c0].astype(np.float64)
+            v01 = tile[r0, c0 + 1].astype(np.float64)
+            v10 = tile[r0 + 1, c0].astype(np.float64)
+            v11 = tile[r0 + 1, c0 + 1].astype(np.float64)
+            values = (v00 * (1 - fr) * (1 - fc) + v01 * (1 - fr) * fc
+                      + v10 * fr * (1 - fc) + v11 * fr * fc)
+            void = (v00 == HGT_VOID) | (v01 == HGT_VOID) | (v10 == HGT_VOID) | (v11 == HGT_VOID)
+            values[void] = np.nan
+            result[points] = values
+        return result
+
+    def correct(self, lat, lon, ele):
+        """GPS elevations replaced by DEM elevations wherever a tile covers the point."""
+        dem = self.sample(lat, lon)
+        ele = np.asarray(ele, dtype=np.float64)
+        return np.where(np.isnan(dem), ele, dem), bool(np.any(~np.isnan(dem)))
@@ -0,0 +1,64 @@
+import numpy as np
+
+# Streams a chart can plot; these decide which points LTTB keeps
+CHART_STREAMS = ('altitude', 'velocity_smooth', 'heartrate', 'cadence', 'watts', 'temp', 'grade_smooth')
+
+def _normalize(values):
+    # Scale to 0..1 so a 0-200 bpm stream and a 0-40000 m stream weigh the same.
+    # Gaps (NaN) sit at 0 and never win a bucket on their own.
+    values = np.asarray(values, dtype=np.float64)
+    if not np.any(~np.isnan(values)):
+        return np.zeros(len(values))
+    low = np.nanmin(values)
+    span = np.nanmax(values) - low
+    if span == 0:
+        return np.zeros(len(values))
+    return np.nan_to_num((values - low) / span)
+
+def lttb_indices(x, ys, threshold):
+    """
+    Largest-Triangle-Three-Buckets over several series sharing one x-axis.
+
+    Returns the indices of the `threshold` points to keep. A single index set
+    is picked for all series (the triangle areas of every series are summed
+    per candidate), so the downsampled streams stay aligned point for point.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = _normalize(x)
+    y = np.column_stack([_normalize(values) for values in ys]) if ys else np.zeros((n, 1))
+
+    every = (n - 2) / (threshold - 2)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third corner of the triangle
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[avg_start:avg_end].mean()
+        avg_y = y[avg_start:avg_end].mean(axis=0)
+
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        areas = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end])[:, None] * (avg_y - y[a])
+        ).sum(axis=1)
+        a = start + int(areas.argmax())
+        selected[i + 1] = a
+    return selected
+
+def lttb_stream_indices(streams, threshold, chart_keys=CHART_STREAMS):
+    """
+    Indices for a dict of 1-D streams. The x-axis is distance when present,
+    otherwise time; every other chart stream present drives the selection.
+    """
+    x_key = 'distance' if 'distance' in streams else 'time' if 'time' in streams else None
+    length = max((len(v) for v in streams.values()), default=0)
+    x = streams[x_key] if x_key else np.arange(length)
+    ys = [streams[key] for key in chart_keys if key in streams and key != x_key]
+    return lttb_indices(x, ys, threshold)
@@ -0,0 +1,212 @@
+import struct
+from datetime import datetime, timedelta, timezone
+from utils.gpx_parser import TrackPoint, track_points_to_activity
+
+FIT_EPOCH = datetime(1989, 12, 31, tzinfo=timezone.utc)
+SEMICIRCLES = 180 / 2**31  # degrees per semicircle
+
+MESG_SPORT = 12
+MESG_SESSION = 18
+MESG_RECORD = 20
+FIELD_TIMESTAMP = 253
+
+# Fields we read per global message number; everything else is skipped
+WANTED_FIELDS = {
+    MESG_RECORD: {0: 'lat', 1: 'lon', 2: 'altitude', 3: 'hr', 4: 'cad', 7: 'watts',
+                  13: 'temp', 78: 'enhanced_altitude', FIELD_TIMESTAMP: 'timestamp'},
+    MESG_SESSION: {5: 'sport', FIELD_TIMESTAMP: 'timestamp'},
+    MESG_SPORT: {0: 'sport', 3: 'name'},
+}
+
+# Base type number -> (struct code, invalid value)
+BASE_TYPES = {
+    0x00: ('B', 0xFF),                # enum
+    0x01: ('b', 0x7F),                # sint8
+    0x02: ('B', 0xFF),                # uint8
+    0x03: ('h', 0x7FFF),              # sint16
+    0x04: ('H', 0xFFFF),              # uint16
+    0x05: ('i', 0x7FFFFFFF),          # sint32
+    0x06: ('I', 0xFFFFFFFF),          # uint32
+    0x07: ('s', None),                # string
+    0x08: ('f', None),                # float32
+    0x09: ('d', None),                # float64
+    0x0A: ('B', 0x00),                # uint8z
+    0x0B: ('H', 0x0000),              # uint16z
+    0x0C: ('I', 0x00000000),          # uint32z
+    0x0D: ('B', None),                # byte
+    0x0E: ('q', 0x7FFFFFFFFFFFFFFF),  # sint64
+    0x0F: ('Q', 0xFFFFFFFFFFFFFFFF),  # uint64
+    0x10: ('Q', 0),                   # uint64z
+}
+
+# FIT sport enum -> Strava sport type
+FIT_SPORTS = {0: 'Workout', 1: 'Run', 2: 'Ride', 4: 'Workout', 5: 'Swim', 11: 'Walk', 17: 'Hike'}
+
+class FitError(ValueError):
+    pass
+
+class _ByteReader:
+    """Reads exact byte counts from a stream through a 64 KB buffer."""
+
+    def __init__(self, stream, chunk_size=64 * 1024):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffer = b''
+        self.offset = 0
+        self.position = 0
+
+    def read(self, size):
+        if self.offset + size > len(self.buffer):
+            rest = self.buffer[self.offset:]
+            chunks = [rest]
+            have = len(rest)
+            while have < size:
+                chunk = self.stream.read(max(self.chunk_size, size - have))
+                if not chunk:
+                    raise FitError('Unexpected end of FIT file')
+                chunks.append(chunk)
+                have += len(chunk)
+            self.buffer = b''.join(chunks)
+            self.offset = 0
+        data = self.buffer[self.offset:self.offset + size]
+        self.offset += size
+        self.position += size
+        return data
+
+    def at_end(self):
+        if self.offset < len(self.buffer):
+            return False
+        self.buffer = self.stream.read(self.chunk_size)
+        self.offset = 0
+        return not self.buffer
+
+class _Definition:
+    """Decoder for the data messages of one local message type."""
+
+    def __init__(self, global_num, little_endian, fields, developer_size):
+        self.global_num = global_num
+        wanted = WANTED_FIELDS.get(global_num, {})
+        codes = ['<' if little_endian else '>']
+        self.names = []
+        self.invalid = []
+        for field_num, size, base_type in fields:
+            code, invalid = BASE_TYPES.get(base_type & 0x1F, ('B', None))
+            name = wanted.get(field_num)
+            if name and code == 's':
+                codes.append(f'{size}s')
+            elif name and struct.calcsize(code) == size:
+                codes.append(code)
+            else:
+                codes.append(f'{size}x')  # arrays and fields we don't use
+                continue
+            self.names.append(name)
+            self.invalid.append(invalid)
+        codes.append(f'{developer_size}x')
+        self.struct = struct.Struct(''.join(codes))
+
+    def decode(self, data):
+        values = {}
+        for name, invalid, value in zip(self.names, self.invalid, self.struct.unpack(data)):
+            if isinstance(value, bytes):
+                value = value.split(b'\0', 1)[0].decode('utf-8', 'replace') or None
+            elif value == invalid:
+                value = None
+            values[name] = value
+        return values
+
+def iter_fit_messages(file_stream):
+    """
+    Yields (global message number, {field name: value}) for the messages in
+    WANTED_FIELDS, decoding the file record by record. Record messages with a
+    compressed timestamp header get their full timestamp filled in.
+    """
+    reader = _ByteReader(file_stream)
+    while True:
+        header = reader.read(12)
+        header_size = header[0]
+        if header[8:12] != b'.FIT' or header_size < 12:
+            raise FitError('Not a FIT file')
+        data_size = struct.unpack('<I', header[4:8])[0]
+        if header_size > 12:
+            reader.read(header_size - 12)
+        end = reader.position + data_size
+
+        definitions = {}
+        last_timestamp = None
+        while reader.position < end:
+            record_header = reader.read(1)[0]
+            if record_header & 0x80:
+                # Compressed timestamp header: 5-bit offset on the last full timestamp
+                local = (record_header >> 5) & 0x03
+                offset = record_header & 0x1F
+                timestamp = None
+                if last_timestamp is not None:
+                    timestamp = (last_timestamp & ~0x1F) + offset
+                    if offset < (last_timestamp & 0x1F):
+                        timestamp += 0x20
+                    last_timestamp = timestamp
+            else:
+                local = record_header & 0x0F
+                timestamp = None
+                if record_header & 0x40:
+                    definitions[local] = _read_definition(reader, bool(record_header & 0x20))
+                    continue
+
+            definition = definitions.get(local)
+            if definition is None:
+                raise FitError(f'Data message for undefined local type {local}')
+            data = reader.read(definition.struct.size)
+            if not definition.names:
+                continue
+            values = definition.decode(data)
+            if values.get('timestamp') is not None:
+                last_timestamp = values['timestamp']
+            elif timestamp is not None:
+                values['timestamp'] = timestamp
+            yield definition.global_num, values
+
+        reader.read(2)  # file CRC
+        # Chained FIT files simply follow each other
+        if reader.at_end():
+            return
+
+def _read_definition(reader, has_developer_fields):
+    _, architecture, global_num, field_count = struct.unpack('<BBHB', reader.read(5))
+    if architecture:
+        global_num = struct.unpack('>H', struct.pack('<H', global_num))[0]
+    raw = reader.read(field_count * 3)
+    fields = [tuple(raw[i:i + 3]) for i in range(0, len(raw), 3)]
+    developer_size = 0
+    if has_developer_fields:
+        developer_count = reader.read(1)[0]
+        raw = reader.read(developer_count * 3)
+        developer_size = sum(raw[i + 1] for i in range(0, len(raw), 3))
+    return _Definition(global_num, architecture == 0, fields, developer_size)
+
+def iter_fit_track_points(file_stream, meta=None):
+    """TrackPoints from the record messages that have a position; sport and name go to meta."""
+    for global_num, values in iter_fit_messages(file_stream):
+        if global_num == MESG_RECORD:
+            if values.get('lat') is None or values.get('lon') is None or values.get('timestamp') is None:
+                continue  # indoor or no GPS fix yet
+            point = TrackPoint(values['lat'] * SEMICIRCLES, values['lon'] * SEMICIRCLES)
+            point.time = FIT_EPOCH + timedelta(seconds=values['timestamp'])
+            altitude = values.get('enhanced_altitude')
+            if altitude is None:
+                altitude = values.get('altitude')
+            point.elevation = altitude / 5 - 500 if altitude is not None else None
+            point.hr = values.get('hr')
+            point.cad = values.get('cad')
+            point.watts = values.get('watts')
+            point.temp = values.get('temp')
+            yield point
+        elif meta is not None and global_num in (MESG_SPORT, MESG_SESSION):
+            if values.get('sport') is not None and 'type' not in meta:
+                meta['type'] = FIT_SPORTS.get(values['sport'], 'Workout')
+            if values.get('name') and 'name' not in meta:
+                meta['name'] = values['name']
+
+def parse_fit_to_strava_format(file_stream, dem=None):
+    """Same as parse_gpx_to_strava_format, for binary FIT files straight from the device."""
+    meta = {}
+    return track_points_to_activity(iter_fit_track_points(file_stream, meta), meta, dem=dem, source='fit')
@@ -1,175 +1,233 @@
-import gpxpy
-import gpxpy.gpx
-import polyline
 import math
-from datetime import datetime
-
-def haversine_distance(lat1, lon1, lat2, lon2):
-    R = 6371000  # meters
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    delta_phi = math.radians(lat2 - lat1)
-    delta_lambda = math.radians(lon2 - lon1)
-    a = math.sin(delta_phi / 2)**2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c
-
-def parse_gpx_to_strava_format(file_stream):
-    gpx = gpxpy.parse(file_stream)
-    
-    track_points = []
-    for track in gpx.tracks:
-        for segment in track.segments:
-            track_points.extend(segment.points)
-
-    if not track_points:
+import numpy as np
+from array import array
+from datetime import datetime, timedelta
+from xml.etree.ElementTree import iterparse
+from utils.activity_metrics import compute_activity_metrics
+from utils.activity_streams import ActivityStreams
+from utils.best_efforts import compute_best_efforts
+from utils.splits import compute_split_tables
+from utils.route_simplify import encode_simplified
+
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+def _local_name(tag):
+    # '{http://www.topografix.com/GPX/1/1}trkpt' -> 'trkpt'
+    return tag.rsplit('}', 1)[-1]
+
+def _parse_time(text):
+    if not text:
+        return None
+    text = text.strip()
+    if text.endswith('Z'):
+        text = text[:-1] + '+00:00'
+    return datetime.fromisoformat(text)
+
+def _parse_float(text):
+    try: return float(text)
+    except (TypeError, ValueError): return None
+
+class TrackPoint:
+    """Lightweight trackpoint, only holds the fields the parser uses."""
+    __slots__ = ('latitude', 'longitude', 'elevation', 'time', 'hr', 'cad', 'temp', 'watts')
+
+    def __init__(self, latitude, longitude):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.elevation = None
+        self.time = None
+        self.hr = None
+        self.cad = None
+        self.temp = None
+        self.watts = None
+
+def _read_extensions(point, extensions):
+    for extension in extensions:
+        # Handle standard GPX extensions (Garmin usually)
+        if 'TrackPointExtension' in extension.tag:
+            for child in extension:
+                if 'hr' in child.tag:
+                    try: point.hr = int(child.text)
+                    except (TypeError, ValueError): pass
+                elif 'cad' in child.tag:
+                    try: point.cad = int(child.text)
+                    except (TypeError, ValueError): pass
+                elif 'atemp' in child.tag:
+                    try: point.temp = float(child.text)
+                    except (TypeError, ValueError): pass
+        # Handle Power (often separate)
+        if 'power' in extension.tag:
+            try: point.watts = float(extension.text)
+            except (TypeError, ValueError): pass
+
+def _to_track_point(elem):
+    point = TrackPoint(float(elem.get('lat')), float(elem.get('lon')))
+    for child in elem:
+        name = _local_name(child.tag)
+        if name == 'ele':
+            point.elevation = _parse_float(child.text)
+        elif name == 'time':
+            point.time = _parse_time(child.text)
+        elif name == 'extensions':
+            _read_extensions(point, child)
+    return point
+
+def iter_gpx_track_points(file_stream, meta=None):
+    """
+    Streams the <trkpt> elements of a GPX file without building the full tree.
+    Every element is detached from its parent once consumed, so memory stays flat
+    no matter how large the upload is. The name of the first track is stored in
+    meta['name'] if a dict is passed in.
+    """
+    stack = []
+    track_count = 0
+    for event, elem in iterparse(file_stream, events=('start', 'end')):
+        if event == 'start':
+            stack.append(elem)
+            if _local_name(elem.tag) == 'trk':
+                track_count += 1
+            continue
+
+        stack.pop()
+        name = _local_name(elem.tag)
+        parent = stack[-1] if stack else None
+        if name == 'trkpt' and parent is not None and _local_name(parent.tag) == 'trkseg':
+            yield _to_track_point(elem)
+        elif name == 'name' and meta is not None and track_count == 1 and 'name' not in meta \
+                and parent is not None and _local_name(parent.tag) == 'trk':
+            meta['name'] = (elem.text or '').strip() or None
+
+        # Free everything that is no longer needed: points and top-level blocks
+        if parent is not None and (name in ('trkpt', 'rtept', 'wpt') or len(stack) == 1):
+            elem.clear()
+            parent.remove(elem)
+
+def _set_sensor_stream(streams, name, values):
+    # 0 means 'no reading'; sensor streams without any reading are left out
+    values = np.asarray(values, dtype=np.float64)
+    valid = values != 0
+    if valid.any():
+        streams.set(name, values, valid=valid)
+
+def parse_gpx_to_strava_format(file_stream, dem=None):
+    """
+    Parses a GPX upload into a Strava-shaped activity dict. With an enabled
+    DemTiles as `dem`, elevations come from the offline elevation model
+    wherever it covers the track.
+    """
+    meta = {}
+    return track_points_to_activity(iter_gpx_track_points(file_stream, meta), meta, dem=dem, source='gpx')
+
+def track_points_to_activity(points, meta, dem=None, source='gpx'):
+    """
+    The part shared by the GPX, TCX and FIT parsers: consumes TrackPoints one
+    at a time into typed columns and runs the metrics kernel over them. The
+    point iterator may fill meta['name'] and meta['type'] (Strava sport type)
+    while it runs. Returns None when there are no points.
+    """
+    # Typed columns, filled while streaming so memory grows with the bytes and
+    # not with one Python object per value. Missing sensor readings are 0.
+    lats = array('d')
+    lons = array('d')
+    altitudes = array('d') # NaN when a point has no <ele>
+    time_offsets = array('q') # in microseconds from start
+    heartrates = array('i')
+    cadences = array('i')
+    temperatures = array('d')
+    powers = array('d')
+
+    start_time = None
+    # Points are consumed one at a time straight from the file stream
+    for point in points:
+        if start_time is None:
+            start_time = point.time
+        lats.append(point.latitude)
+        lons.append(point.longitude)
+        altitudes.append(point.elevation if point.elevation is not None else math.nan)
+        time_offsets.append((point.time - start_time) // ONE_MICROSECOND)
+        heartrates.append(point.hr or 0)
+        cadences.append(point.cad or 0)
+        powers.append(point.watts or 0)
+        temperatures.append(point.temp or 0)
+
+    if start_time is None:
         return None
 
-    # Streams
-    latlngs = []
-    altitudes = []
-    heartrates = []
-    cadences = []
-    temperatures = []
-    powers = []
-    times = [] # in seconds from start
-    distances = [] # cumulative distance
-    
-    start_time = track_points[0].time
-    total_distance = 0
-    total_elevation_gain = 0
-    max_speed = 0
-    max_hr = 0
-    max_cadence = 0
-    max_watts = 0
-    prev_point = None
-    elev_high = -float('inf')
-    
-    for point in track_points:
-        latlngs.append([point.latitude, point.longitude])
-        altitudes.append(point.elevation)
-        if point.elevation > elev_high:
-            elev_high = point.elevation
-            
-        # Extensions handling (HR, Cadence, Power, Temp)
-        hr = None
-        cad = None
-        temp = None
-        watts = None
-        
-        for extension in point.extensions:
-            # Handle standard GPX extensions (Garmin usually)
-            if 'TrackPointExtension' in extension.tag:
-                for child in extension:
-                    if 'hr' in child.tag:
-                        try: hr = int(child.text)
-                        except: pass
-                    elif 'cad' in child.tag:
-                        try: cad = int(child.text)
-                        except: pass
-                    elif 'atemp' in child.tag:
-                        try: temp = float(child.text)
-                        except: pass
-            # Handle Power (often separate)
-            if 'power' in extension.tag:
-                 try: watts = float(extension.text)
-                 except: pass
-
-        if hr: 
-            heartrates.append(hr)
-            if hr > max_hr: max_hr = hr
-        else:
-            heartrates.append(None) # Maintain indices
-            
-        if cad:
-            cadences.append(cad)
-            if cad > max_cadence: max_cadence = cad
-        else:
-            cadences.append(None)
-
-        if watts:
-            powers.append(watts)
-            if watts > max_watts: max_watts = watts
-        else:
-            powers.append(None)
-            
-        if temp:
-            temperatures.append(temp)
-        else:
-            temperatures.append(None)
-
-        # Distance & Time
-        dist_inc = 0
-        if prev_point:
-            dist_inc = haversine_distance(prev_point.latitude, prev_point.longitude, point.latitude, point.longitude)
-            total_distance += dist_inc
-            
-            # Simple elevation gain
-            ele_diff = point.elevation - prev_point.elevation
-            if ele_diff > 0:
-                total_elevation_gain += ele_diff
-                
-            # Speed calc (instant)
-            time_diff = (point.time - prev_point.time).total_seconds()
-            if time_diff > 0:
-                speed = dist_inc / time_diff
-                if speed > max_speed: max_speed = speed
-        
-        distances.append(total_distance)
-        times.append((point.time - start_time).total_seconds())
-        prev_point = point
-
-    # Moving time (simplified: total elapsed for now, or filter stops)
-    elapsed_time = int((track_points[-1].time - start_time).total_seconds())
-    moving_time = elapsed_time # Rough approximation
-    
-    # Averages
+    times = np.frombuffer(time_offsets, dtype=np.int64) / 1e6
+    sport_type = meta.get('type') or 'Run'
+    elevation_source = 'gps'
+    if dem is not None and dem.enabled:
+        altitudes, corrected = dem.correct(lats, lons, altitudes)
+        if corrected:
+            elevation_source = 'dem'
+    metrics = compute_activity_metrics(
+        lats, lons, altitudes, times,
+        heartrate=heartrates, cadence=cadences, watts=powers, sport_type=sport_type
+    )
+    total_distance = metrics['distance']
+    elapsed_time = metrics['elapsed_time']
+
+    moving_time = metrics['moving_time']
     avg_speed = total_distance / moving_time if moving_time > 0 else 0
-    avg_hr = sum(filter(None, heartrates)) / len(list(filter(None, heartrates))) if any(heartrates) else None
-    avg_cadence = sum(filter(None, cadences)) / len(list(filter(None, cadences))) if any(cadences) else None
-    avg_watts = sum(filter(None, powers)) / len(list(filter(None, powers))) if any(powers) else None
-
-    # Summary Polyline
-    summary_polyline = polyline.encode(latlngs)
-
-    # Normalize structure to Strava API format
-    streams = {
-        'latlng': latlngs,
-        'altitude': altitudes,
-        'time': times,
-        'distance': distances,
-        'heartrate': heartrates if any(heartrates) else None,
-        'cadence': cadences if any(cadences) else None,
-        'watts': powers if any(powers) else None,
-        'temp': temperatures if any(temperatures) else None,
-        'velocity_smooth': [] # Optional to derive from distance/time
-    }
-    
-    # Clean up None streams
-    streams = {k: v for k, v in streams.items() if v is not None}
+
+    latlng = np.column_stack((lats, lons))
+
+    best_efforts = compute_best_efforts(
+        times, metrics['streams']['distance'],
+        watts=np.frombuffer(powers, dtype=np.float64), sport_type=sport_type
+    )
+
+    # Summary Polyline, simplified to thumbnail size like Strava's own
+    summary_polyline = encode_simplified(latlng, 'thumbnail')
+
+    # Normalize structure to Strava API format, stored as typed columns
+    streams = ActivityStreams(len(lats))
+    streams.set('latlng', latlng)
+    streams.set('altitude', altitudes)
+    streams.set('time', times)
+    streams.set('distance', metrics['streams']['distance'])
+    if metrics['streams']['grade_smooth'] is not None:
+        streams.set('grade_smooth', metrics['streams']['grade_smooth'])
+    streams.set('moving', metrics['streams']['moving'])
+    _set_sensor_stream(streams, 'heartrate', heartrates)
+    _set_sensor_stream(streams, 'cadence', cadences)
+    _set_sensor_stream(streams, 'watts', powers)
+    _set_sensor_stream(streams, 'temp', temperatures)
+
+    splits = compute_split_tables(
+        metrics['streams']['distance'], times, altitude=altitudes,
+        heartrate=streams.float_values('heartrate') if 'heartrate' in streams else None,
+        watts=streams.float_values('watts') if 'watts' in streams else None,
+        moving=metrics['streams']['moving']
+    )
 
     return {
-        'id': f"gpx_{int(start_time.timestamp())}",
-        'name': gpx.tracks[0].name or "Uploaded Activity",
+        'id': f"{source}_{int(start_time.timestamp())}",
+        'name': meta.get('name') or "Uploaded Activity",
         'distance': total_distance,
         'moving_time': moving_time,
         'elapsed_time': elapsed_time,
-        'total_elevation_gain': total_elevation_gain,
-        'elev_high': elev_high,
+        'total_elevation_gain': metrics['total_elevation_gain'],
+        'total_elevation_loss': metrics['total_elevation_loss'],
+        'elev_high': metrics['elev_high'],
+        'elev_low': metrics['elev_low'],
+        'elevation_source': elevation_source,
         'average_speed': avg_speed,
-        'max_speed': max_speed,
-        'average_heartrate': avg_hr,
-        'max_heartrate': max_hr,
-        'average_cadence': avg_cadence,
-        'max_cadence': max_cadence,
-        'average_watts': avg_watts,
-        'max_watts': max_watts,
+        'max_speed': metrics['max_speed'],
+        'average_heartrate': metrics['average_heartrate'],
+        'max_heartrate': metrics['max_heartrate'],
+        'average_cadence': metrics['average_cadence'],
+        'max_cadence': metrics['max_cadence'],
+        'average_watts': metrics['average_watts'],
+        'max_watts': metrics['max_watts'],
+        'best_efforts': best_efforts,
+        'splits': splits,
         'start_date': start_time.isoformat(),
-        'start_latlng': latlngs[0] if latlngs else None,
+        'start_latlng': [lats[0], lons[0]],
         'map': {
              'summary_polyline': summary_polyline
         },
         'streams': streams,
-        'source': 'gpx',
-        'type': 'Run' # Default to Run for GPX
+        'source': source,
+        'type': sport_type # Run unless the file says otherwise
     }
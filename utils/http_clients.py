@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+class LatencyMetrics:
+    """Per-service request counters plus a window of recent latencies."""
+
+    def __init__(self, window=500):
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=window)
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.status_counts = {}
+
+    def record(self, elapsed_ms, status=None):
+        with self._lock:
+            self.count += 1
+            self.total_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+            self._recent.append(elapsed_ms)
+            key = str(status) if status is not None else 'error'
+            self.status_counts[key] = self.status_counts.get(key, 0) + 1
+            if status is None or status >= 500:
+                self.errors += 1
+
+    def snapshot(self):
+        with self._lock:
+            recent = sorted(self._recent)
+            def percentile(p):
+                return round(recent[min(len(recent) - 1, int(len(recent) * p))], 1) if recent else None
+            return {
+                'count': self.count,
+                'errors': self.errors,
+                'avg_ms': round(self.total_ms / self.count, 1) if self.count else None,
+                'p50_ms': percentile(0.5),
+                'p95_ms': percentile(0.95),
+                'max_ms': round(self.max_ms, 1),
+                'status_counts': dict(self.status_counts),
+            }
+
+class ServiceClient:
+    """
+    Pooled HTTP client for one upstream service.
+
+    Keeps connections alive between requests, applies the service's default
+    timeout, retries idempotent calls on 429/5xx with exponential backoff
+    (honouring Retry-After) and records latency for every call. The sessions
+    are created lazily per process, so gunicorn workers never share sockets.
+
+    request(..., retry_reads=False) doesn't retry reads that timed out or
+    broke off, so a slow upstream costs a request worker one read timeout
+    rather than one per retry.
+    """
+
+    def __init__(self, name, timeout, retries=3, backoff=0.5, pool_size=10, retry_statuses=RETRY_STATUSES):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.retry_statuses = retry_statuses
+        self.metrics = LatencyMetrics()
+        self._sessions = {}  # retry_reads -> requests.Session
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        return self._get_session(retry_reads=True)
+
+    def _get_session(self, retry_reads):
+        session = self._sessions.get(retry_reads) if self._pid == os.getpid() else None
+        if session is None:
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._sessions = {}
+                    self._pid = os.getpid()
+                session = self._sessions.get(retry_reads)
+                if session is None:
+                    session = self._sessions[retry_reads] = self._build_session(retry_reads)
+        return session
+
+    def _build_session(self, retry_reads=True):
+        retry = Retry(
+            total=self.retries,
+            read=None if retry_reads else 0,
+            backoff_factor=self.backoff,
+            status_forcelist=self.retry_statuses,
+            respect_retry_after_header=True,
+            raise_on_status=False,  # hand back the last response, callers use raise_for_status()
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.hooks['response'].append(self._on_response)
+        return session
+
+    def _on_response(self, response, *args, **kwargs):
+        # Also catches requests made by libraries that were handed our session (Stripe)
+        self.metrics.record(response.elapsed.total_seconds() * 1000, response.status_code)
+
+    def request(self, method, url, retry_reads=True, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        start = time.perf_counter()
+        try:
+            return self._get_session(retry_reads).request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            self.metrics.record((time.perf_counter() - start) * 1000)
+            raise
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+# (connect, read) timeouts in seconds
+# Strava 429s mean the app-wide quota is gone; retrying only burns more of it
+strava = ServiceClient('strava', timeout=(3.05, 10), retry_statuses=(500, 502, 503, 504))
+printful = ServiceClient('printful', timeout=(3.05, 20))
+stripe_http = ServiceClient('stripe', timeout=(3.05, 30))
+
+SERVICES = (strava, printful, stripe_http)
+
+def configure_stripe(stripe_module):
+    """Routes the Stripe SDK through the pooled session. Stripe retries itself with idempotency keys."""
+    stripe_module.default_http_client = stripe_module.RequestsClient(
+        timeout=stripe_http.timeout[1], session=stripe_http.session
+    )
+    stripe_module.max_network_retries = 2
+
+def http_metrics():
+    return {client.name: client.metrics.snapshot() for client in SERVICES}
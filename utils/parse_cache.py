@@ -0,0 +1,171 @@
+import hashlib
+import os
+import tempfile
+import threading
+
+from utils.activity_streams import ActivityStreams
+from utils.shared_files import write_atomic
+
+# Bump when a parser change alters the parsed output, so old entries stop matching
+PARSER_VERSION = 2
+
+def cache_key(digest, dem_dir=None):
+    """
+    Entry key for an upload's content digest under the current parser
+    settings: the parse also depends on the parser version and on the DEM
+    tiles the elevations were corrected from. Tiles added to or removed from
+    DEM_DIR change its mtime and with it the key.
+    """
+    dem = 'no-dem'
+    if dem_dir:
+        try:
+            dem = f'{os.path.abspath(dem_dir)}@{os.stat(dem_dir).st_mtime_ns}'
+        except OSError:
+            dem = 'missing-dem'  # the parse then keeps the GPS elevations, like without DEM_DIR
+    return hashlib.sha256(f'{digest}:{PARSER_VERSION}:{dem}'.encode('utf-8')).hexdigest()
+
+def entry_path(directory, key):
+    return os.path.join(directory, f'{key}.bin')
+
+class UploadTooLarge(ValueError):
+    pass
+
+def spool_and_hash(stream, target, chunk_size=64 * 1024, max_bytes=None):
+    """
+    Copies an upload stream into target chunk by chunk, returning its sha256
+    hex digest. Raises UploadTooLarge as soon as more than max_bytes came in.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        size += len(chunk)
+        if max_bytes is not None and size > max_bytes:
+            raise UploadTooLarge(f'more than {max_bytes} bytes')
+        digest.update(chunk)
+        target.write(chunk)
+    return digest.hexdigest()
+
+def encode_entry(activity_data):
+    """Cache entry for a parsed activity: its full-resolution streams, summary in the header."""
+    summary = {k: v for k, v in activity_data.items() if k not in ('streams', 'local_id')}
+    return activity_data['streams'].to_bytes(meta={'details': summary})
+
+class ParseCache:
+    """
+    Parsed uploads keyed by the sha256 of the uploaded bytes (see cache_key),
+    so re-uploading the same GPX/TCX/FIT file skips the parse. Entries hold
+    the full-resolution parse and stand in for it everywhere.
+
+    Entries are ActivityStreams buffers in PARSE_CACHE_DIR, one file per
+    digest, so they are shared by the workers and survive restarts. Hits
+    touch the file; once the directory grows past PARSE_CACHE_MAX_BYTES the
+    least recently used entries are removed.
+    """
+
+    def __init__(self, app=None):
+        self.directory = os.path.join(tempfile.gettempdir(), 'miles-to-merch-parse-cache')
+        self.max_bytes = 256 * 1024 * 1024
+        self.dem_dir = None
+        self._size = None  # bytes on disk, recounted now and then since other workers write too
+        self._writes = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.directory = app.config.get('PARSE_CACHE_DIR') or self.directory
+        self.max_bytes = app.config.get('PARSE_CACHE_MAX_BYTES', self.max_bytes)
+        self.dem_dir = app.config.get('DEM_DIR') or None
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, digest):
+        """Entry key for an upload's digest, under this app's parser settings."""
+        return cache_key(digest, self.dem_dir)
+
+    def path(self, key):
+        return entry_path(self.directory, key)
+
+    # --- Public API ---
+
+    def get_bytes(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                blob = f.read()
+            os.utime(path)  # recency for eviction
+        except OSError:
+            return None
+        return blob
+
+    def get(self, key):
+        """The cached activity (with 'streams' as ActivityStreams) for a key, or None."""
+        blob = self.get_bytes(key)
+        if blob is None:
+            return None
+        try:
+            streams, meta = ActivityStreams.from_bytes(blob)
+        except ValueError:
+            return None
+        activity_data = meta['details']
+        activity_data['streams'] = streams
+        return activity_data
+
+    def set(self, key, activity_data):
+        path = self.path(key)
+        try:
+            write_atomic(path, encode_entry(activity_data))
+        except OSError as e:
+            print(f"ParseCache: could not write {path}: {e}")
+            return
+        self.added(key)
+
+    def added(self, key):
+        """Accounts for an entry written to path(key), by this or another process."""
+        try:
+            size = os.path.getsize(self.path(key))
+        except OSError:
+            return
+        with self._lock:
+            self._writes += 1
+            if self._size is None or self._writes % 100 == 0:
+                self._size = self._disk_size()
+            else:
+                self._size += size
+            if self._size <= self.max_bytes:
+                return
+            self._size = self._evict()
+
+    # --- Eviction ---
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.bin'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+        return entries
+
+    def _disk_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        """Removes the oldest entries until the directory is under 90% of max_bytes; returns the new size."""
+        entries = sorted(self._entries())
+        size = sum(entry[1] for entry in entries)
+        target = self.max_bytes * 0.9
+        for _, entry_size, name in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+                size -= entry_size
+            except OSError:
+                pass
+        return size
@@ -0,0 +1,85 @@
+import numpy as np
+import polyline
+
+EARTH_RADIUS = 6371000  # meters
+
+# Simplification levels, as the number of pixels the route's bounding box
+# diagonal covers at that size. The allowed error is one pixel.
+SIMPLIFY_LEVELS = {
+    'thumbnail': 300,
+    'editor': 1500,
+    'print': 5000,
+}
+
+def _project(latlng):
+    # Equirectangular projection to meters, plenty accurate at route scale
+    lat = np.radians(latlng[:, 0])
+    lon = np.radians(latlng[:, 1])
+    x = lon * np.cos(lat.mean()) * EARTH_RADIUS
+    y = lat * EARTH_RADIUS
+    return x, y
+
+def _segment_distances(x, y, first, last):
+    """Distance of the points strictly between first and last to that segment."""
+    px = x[first + 1:last] - x[first]
+    py = y[first + 1:last] - y[first]
+    dx = x[last] - x[first]
+    dy = y[last] - y[first]
+    length_sq = dx * dx + dy * dy
+    if length_sq == 0:
+        # Closed loop: the 'segment' is a single point
+        return np.hypot(px, py)
+    t = np.clip((px * dx + py * dy) / length_sq, 0, 1)
+    return np.hypot(px - t * dx, py - t * dy)
+
+def douglas_peucker(latlng, tolerance):
+    """
+    Indices of the points Douglas-Peucker keeps for the given tolerance in
+    meters. Runs on an explicit stack (no recursion limit on long tracks)
+    and measures every segment's points in one vectorized call.
+    """
+    latlng = np.asarray(latlng, dtype=np.float64)
+    n = len(latlng)
+    if n < 3:
+        return np.arange(n)
+
+    x, y = _project(latlng)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        distances = _segment_distances(x, y, first, last)
+        farthest = int(distances.argmax())
+        if distances[farthest] > tolerance:
+            index = first + 1 + farthest
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return np.flatnonzero(keep)
+
+def level_tolerance(latlng, level):
+    """Allowed error in meters for a level: one pixel of the rendered route."""
+    x, y = _project(np.asarray(latlng, dtype=np.float64))
+    diagonal = np.hypot(x.max() - x.min(), y.max() - y.min())
+    return diagonal / SIMPLIFY_LEVELS[level]
+
+def simplify_indices(latlng, level):
+    latlng = np.asarray(latlng, dtype=np.float64)
+    if len(latlng) < 3:
+        return np.arange(len(latlng))
+    return douglas_peucker(latlng, level_tolerance(latlng, level))
+
+def encode_simplified(latlng, level):
+    latlng = np.asarray(latlng, dtype=np.float64)
+    return polyline.encode(latlng[simplify_indices(latlng, level)].tolist())
+
+def take_strava_streams(streams, indices):
+    """Keeps only the given points in every stream of a key_by_type Strava response."""
+    taken = {}
+    for key, stream in streams.items():
+        data = stream.get('data') or []
+        taken[key] = dict(stream, data=[data[i] for i in indices if i < len(data)])
+    return taken
@@ -0,0 +1,32 @@
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: file locks are then not available
+    fcntl = None
+
+# Whether lock_file() can serialize processes; without it callers keep their state per process
+HAS_FLOCK = fcntl is not None
+
+def write_atomic(path, data):
+    """
+    Writes data (bytes or str) to path through a temporary file and a rename,
+    so readers in other workers never see a half-written file.
+    """
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp_path, 'wb' if isinstance(data, bytes) else 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def lock_file(f):
+    """Takes an exclusive lock on an open file, held until it is closed. A no-op without HAS_FLOCK."""
+    if HAS_FLOCK:
+        fcntl.flock(f, fcntl.LOCK_EX)
@@ -0,0 +1,99 @@
+import numpy as np
+
+SPLIT_UNITS = {
+    'metric': 1000.0,     # per km
+    'imperial': 1609.344, # per mile
+}
+
+def _interp_valid(x, xp, values):
+    """Values at x, interpolated over the valid (non-NaN) samples only."""
+    valid = ~np.isnan(values)
+    if not valid.any():
+        return None
+    return np.interp(x, xp[valid], values[valid])
+
+def _split_means(labels, values, count):
+    """Mean of values per split label, ignoring NaN (None when a split has no readings)."""
+    if values is None:
+        return [None] * count
+    valid = ~np.isnan(values)
+    totals = np.bincount(labels[valid], weights=values[valid], minlength=count)[:count]
+    counts = np.bincount(labels[valid], minlength=count)[:count]
+    means = np.divide(totals, counts, out=np.full(count, np.nan), where=counts > 0)
+    return [None if np.isnan(m) else round(m.item(), 1) for m in means]
+
+def compute_splits(distance, time, altitude=None, heartrate=None, watts=None, moving=None, unit=1000.0):
+    """
+    Splits table over a cumulative distance stream: one row per `unit`
+    meters plus the partial last one. Split edges are found by binary search
+    on the distance stream and time/altitude are interpolated at the exact
+    edge, so nothing loops over the points in Python. With a `moving`
+    stream, moving time (and the pace and speed derived from it) leaves out
+    the stops.
+    """
+    distance = np.asarray(distance, dtype=np.float64)
+    time = np.asarray(time, dtype=np.float64)
+    keep = ~(np.isnan(distance) | np.isnan(time))
+    if keep.sum() < 2:
+        return []
+
+    def column(values):
+        if values is None:
+            return None
+        values = np.asarray(values, dtype=np.float64)
+        return values[keep] if values.size == keep.size else None
+
+    distance, time = distance[keep], time[keep]
+    altitude, heartrate, watts, moving = column(altitude), column(heartrate), column(watts), column(moving)
+
+    total = distance[-1]
+    if total <= distance[0]:
+        return []
+    edges = np.arange(distance[0], total, unit)
+    if total - edges[-1] < 1:
+        # Don't end on a sliver of a split
+        edges = edges[:-1] if edges.size > 1 else edges
+    edges = np.append(edges, total)
+    count = edges.size - 1
+    if count < 1:
+        return []
+
+    edge_times = np.interp(edges, distance, time)
+    elapsed = np.diff(edge_times)
+    lengths = np.diff(edges)
+    edge_altitudes = _interp_valid(edges, distance, altitude) if altitude is not None else None
+    elevation = np.diff(edge_altitudes) if edge_altitudes is not None else None
+
+    # Split number of every point, for the sensor averages
+    labels = np.minimum(np.searchsorted(edges, distance, side='right') - 1, count - 1)
+    heartrates = _split_means(labels, heartrate, count)
+    powers = _split_means(labels, watts, count)
+    if moving is not None:
+        dt = np.diff(time, prepend=time[0])
+        moving_times = np.bincount(labels, weights=dt * (moving > 0), minlength=count)[:count]
+    else:
+        moving_times = elapsed
+
+    splits = []
+    for i in range(count):
+        seconds = moving_times[i].item()
+        meters = lengths[i].item()
+        splits.append({
+            'split': i + 1,
+            'distance': round(meters, 1),
+            'elapsed_time': int(round(elapsed[i].item())),
+            'moving_time': int(round(seconds)),
+            'elevation_difference': round(elevation[i].item(), 1) if elevation is not None else None,
+            'average_speed': round(meters / seconds, 3) if seconds > 0 else 0,
+            'pace': round(seconds / (meters / unit), 1) if meters > 0 else None,  # seconds per unit
+            'average_heartrate': heartrates[i],
+            'average_watts': powers[i],
+        })
+    return splits
+
+def compute_split_tables(distance, time, altitude=None, heartrate=None, watts=None, moving=None):
+    """Metric (km) and imperial (mile) split tables."""
+    return {
+        system: compute_splits(distance, time, altitude, heartrate, watts, moving, unit)
+        for system, unit in SPLIT_UNITS.items()
+    }
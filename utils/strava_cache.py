@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from utils.shared_files import write_atomic
+
+class StravaCache:
+    """
+    Read-through cache for Strava activity payloads (details, streams, photos).
+
+    Entries are keyed by (kind, athlete, activity_id, extra) and stored as
+    compressed JSON. The first tier is a size-bounded LRU in this worker's
+    memory; the optional second tier is a directory shared by all gunicorn
+    workers on the machine (set STRAVA_CACHE_DIR). Both expire after
+    STRAVA_CACHE_TTL seconds.
+
+    invalidate() also touches a marker file per activity that every worker
+    checks on a memory hit, so an invalidation reaches all workers at once.
+    """
+
+    def __init__(self, app=None):
+        self.ttl = 900
+        self.max_bytes = 64 * 1024 * 1024
+        self.directory = None
+        self.marker_directory = os.path.join(tempfile.gettempdir(), 'miles-to-merch-strava-invalidated')
+        self._entries = OrderedDict()  # key -> (expires_at, stored_at_ns, blob)
+        self._size = 0
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._invalidations = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config.get('STRAVA_CACHE_TTL', self.ttl)
+        self.max_bytes = app.config.get('STRAVA_CACHE_MAX_BYTES', self.max_bytes)
+        self.directory = app.config.get('STRAVA_CACHE_DIR') or None
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self.marker_directory = os.path.join(self.directory, '.invalidated')
+        os.makedirs(self.marker_directory, exist_ok=True)
+
+    # --- Keys ---
+
+    @staticmethod
+    def _key(kind, athlete, activity_id, extra=''):
+        return (kind, str(athlete), str(activity_id), extra)
+
+    def _path(self, key):
+        kind, athlete, activity_id, extra = key
+        digest = hashlib.sha1(extra.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.directory, athlete, activity_id, f'{kind}-{digest}.json.z')
+
+    def _marker_path(self, athlete, activity_id):
+        return os.path.join(self.marker_directory, f'{athlete}-{activity_id}')
+
+    # --- Public API ---
+
+    def get(self, kind, athlete, activity_id, extra=''):
+        key = self._key(kind, athlete, activity_id, extra)
+        blob = self._memory_get(key)
+        if blob is None and self.directory:
+            entry = self._disk_get(key)
+            if entry is not None:
+                # Promoted with the disk entry's remaining lifetime, not a fresh TTL
+                expires_at, stored_at_ns, blob = entry
+                self._memory_set(key, blob, expires_at, stored_at_ns)
+        if blob is None:
+            return None
+        return json.loads(zlib.decompress(blob))
+
+    def set(self, kind, athlete, activity_id, value, extra=''):
+        key = self._key(kind, athlete, activity_id, extra)
+        blob = zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'), 1)
+        self._memory_set(key, blob)
+        if self.directory:
+            self._disk_set(key, blob)
+
+    def invalidate(self, athlete, activity_id):
+        """Drops every cached payload of one activity, in every worker's memory and on disk."""
+        athlete, activity_id = str(athlete), str(activity_id)
+        marker = self._marker_path(athlete, activity_id)
+        try:
+            with open(marker, 'a'):
+                pass
+            os.utime(marker)
+        except OSError as e:
+            print(f"StravaCache: could not write {marker}: {e}")
+        with self._lock:
+            for key in [k for k in self._entries if k[1] == athlete and k[2] == activity_id]:
+                self._size -= len(self._entries.pop(key)[2])
+        if self.directory:
+            shutil.rmtree(os.path.join(self.directory, athlete, activity_id), ignore_errors=True)
+        self._invalidations += 1
+        if self._invalidations % 200 == 0:
+            self._prune_markers()
+
+    def _prune_markers(self):
+        # Anything cached before an old marker has expired anyway
+        cutoff = time.time() - self.ttl
+        for name in os.listdir(self.marker_directory):
+            path = os.path.join(self.marker_directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    # --- Memory tier ---
+
+    def _memory_get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, stored_at_ns, blob = entry
+            if expires_at < time.time() or self._invalidated_since(key, stored_at_ns):
+                del self._entries[key]
+                self._size -= len(blob)
+                return None
+            self._entries.move_to_end(key)
+            return blob
+
+    def _invalidated_since(self, key, stored_at_ns):
+        # One stat() per memory hit; the marker only exists after an invalidate()
+        try:
+            return os.stat(self._marker_path(key[1], key[2])).st_mtime_ns >= stored_at_ns
+        except OSError:
+            return False
+
+    def _memory_set(self, key, blob, expires_at=None, stored_at_ns=None):
+        if len(blob) > self.max_bytes:
+            return
+        if expires_at is None:
+            expires_at = time.time() + self.ttl
+        if stored_at_ns is None:
+            stored_at_ns = time.time_ns()
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old[2])
+            self._entries[key] = (expires_at, stored_at_ns, blob)
+            self._size += len(blob)
+            while self._size > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    # --- Disk tier (shared between workers) ---
+
+    def _disk_get(self, key):
+        """(expires_at, stored_at_ns, blob) of a live disk entry, or None."""
+        path = self._path(key)
+        try:
+            stored_at_ns = os.stat(path).st_mtime_ns
+            expires_at = stored_at_ns / 1e9 + self.ttl
+            if expires_at < time.time():
+                os.remove(path)
+                return None
+            with open(path, 'rb') as f:
+                return expires_at, stored_at_ns, f.read()
+        except OSError:
+            return None
+
+    def _disk_set(self, key, blob):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_atomic(path, blob)
+        except OSError as e:
+            print(f"StravaCache: could not write {path}: {e}")
+            return
+        self._writes += 1
+        if self._writes % 200 == 0:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        cutoff = time.time() - self.ttl
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                except OSError:
+                    pass
@@ -0,0 +1,194 @@
+import json
+import threading
+import time
+from concurrent.futures import Future
+
+import requests
+
+from utils.shared_files import HAS_FLOCK, lock_file
+
+# Priorities: interactive calls may use the whole budget, background work
+# (history paging, photos) must leave a reserve for them
+INTERACTIVE = 0
+BACKGROUND = 1
+
+SHORT_WINDOW = 15 * 60
+DAY = 24 * 60 * 60
+
+class StravaRateLimited(requests.exceptions.RequestException):
+    """Raised instead of calling Strava when the rate limit budget does not allow it."""
+
+    def __init__(self, retry_after, priority=INTERACTIVE):
+        super().__init__(f'Strava rate limit budget exhausted, retry in {int(retry_after)}s')
+        self.retry_after = int(retry_after) + 1
+        self.priority = priority
+
+class StravaScheduler:
+    """
+    Admission control in front of the Strava client.
+
+    Strava limits the whole app per 15 minutes (reset on the quarter hour)
+    and per day (reset at midnight UTC) and reports the usage in the
+    X-RateLimit-* / X-ReadRateLimit-* headers of every response. The usage is
+    kept in a small state file shared by all workers on the machine (flock),
+    counted up before each call and corrected from the headers afterwards.
+
+    Identical requests that are already in flight in this worker are
+    coalesced: the second caller waits for the first response instead of
+    spending budget on it. Background calls are shed (StravaRateLimited) as
+    soon as the remaining budget drops below STRAVA_BACKGROUND_RESERVE, so
+    interactive calls keep working until the budget is really gone.
+    """
+
+    def __init__(self, client, app=None):
+        self.client = client
+        self.state_file = None
+        self.background_reserve = 0.2
+        self._state = self._fresh_state(time.time())
+        self._state_lock = threading.Lock()
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self.coalesced = 0
+        self.shed = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.state_file = app.config.get('STRAVA_RATE_STATE_FILE') or None
+        self.background_reserve = app.config.get('STRAVA_BACKGROUND_RESERVE', self.background_reserve)
+
+    # --- Public API ---
+
+    def request(self, method, url, priority=INTERACTIVE, **kwargs):
+        key = self._key(method, url, kwargs)
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+
+        try:
+            self._admit(priority)
+            # Interactive calls hold a request worker: a read that timed out isn't retried
+            response = self.client.request(method, url, retry_reads=priority == BACKGROUND, **kwargs)
+            self._record(response)
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+
+    def get(self, url, priority=INTERACTIVE, **kwargs):
+        return self.request('GET', url, priority=priority, **kwargs)
+
+    def stats(self):
+        state = self._update(lambda state: dict(state))
+        state.update({'coalesced': self.coalesced, 'shed': self.shed, 'inflight': len(self._inflight)})
+        return state
+
+    # --- Budget ---
+
+    @staticmethod
+    def _fresh_state(now):
+        return {
+            'window': int(now // SHORT_WINDOW), 'day': int(now // DAY),
+            'short_usage': 0, 'short_limit': 100,
+            'daily_usage': 0, 'daily_limit': 1000,
+            'blocked_until': 0,
+        }
+
+    def _admit(self, priority):
+        def take(state):
+            now = time.time()
+            if state['blocked_until'] > now:
+                return state['blocked_until'] - now
+            reserve = self.background_reserve if priority == BACKGROUND else 0
+            if state['short_limit'] - state['short_usage'] <= state['short_limit'] * reserve:
+                return (state['window'] + 1) * SHORT_WINDOW - now
+            if state['daily_limit'] - state['daily_usage'] <= state['daily_limit'] * reserve:
+                return (state['day'] + 1) * DAY - now
+            state['short_usage'] += 1
+            state['daily_usage'] += 1
+            return 0
+
+        wait = self._update(take)
+        if wait > 0:
+            self.shed += 1
+            raise StravaRateLimited(wait, priority)
+
+    def _record(self, response):
+        headers = response.headers
+        # Reads have their own, lower limit; fall back to the overall one
+        limit = headers.get('X-ReadRateLimit-Limit') or headers.get('X-RateLimit-Limit')
+        usage = headers.get('X-ReadRateLimit-Usage') or headers.get('X-RateLimit-Usage')
+        if not (limit and usage) and response.status_code != 429:
+            return
+
+        def apply(state):
+            if limit and usage:
+                try:
+                    state['short_limit'], state['daily_limit'] = (int(v) for v in limit.split(','))
+                    state['short_usage'], state['daily_usage'] = (int(v) for v in usage.split(','))
+                except ValueError:
+                    pass
+            if response.status_code == 429:
+                # Nobody gets through until the exhausted window resets
+                if state['daily_usage'] >= state['daily_limit']:
+                    state['blocked_until'] = (state['day'] + 1) * DAY
+                else:
+                    state['blocked_until'] = (state['window'] + 1) * SHORT_WINDOW
+                print(f"Strava rate limit hit, holding calls until {state['blocked_until']}")
+
+        self._update(apply)
+
+    def _update(self, fn):
+        """Runs fn on the current (rolled over) state under a lock shared by all workers."""
+        with self._state_lock:
+            if not self.state_file or not HAS_FLOCK:  # the budget is then tracked per process
+                self._roll(self._state)
+                return fn(self._state)
+            try:
+                with open(self.state_file, 'a+') as f:
+                    lock_file(f)
+                    f.seek(0)
+                    try:
+                        state = json.loads(f.read() or 'null') or self._fresh_state(time.time())
+                    except ValueError:
+                        state = self._fresh_state(time.time())
+                    self._roll(state)
+                    result = fn(state)
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+                    self._state = state
+                    return result
+            except OSError as e:
+                print(f"StravaScheduler: could not use {self.state_file}: {e}")
+                self._roll(self._state)
+                return fn(self._state)
+
+    @staticmethod
+    def _roll(state):
+        now = time.time()
+        if state['window'] != int(now // SHORT_WINDOW):
+            state['window'] = int(now // SHORT_WINDOW)
+            state['short_usage'] = 0
+        if state['day'] != int(now // DAY):
+            state['day'] = int(now // DAY)
+            state['daily_usage'] = 0
+
+    # --- Coalescing ---
+
+    @staticmethod
+    def _key(method, url, kwargs):
+        params = kwargs.get('params') or {}
+        auth = (kwargs.get('headers') or {}).get('Authorization')
+        return (method, url, tuple(sorted((k, str(v)) for k, v in params.items())), auth)
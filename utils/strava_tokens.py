@@ -0,0 +1,103 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from extensions import db
+from models import User
+from utils.http_clients import strava
+
+REFRESH_AHEAD = 30 * 60  # renew in the background once less than this is left
+EXPIRY_SLACK = 60        # with less than this left the token counts as expired
+
+class StravaTokenManager:
+    """
+    Keeps users' Strava access tokens fresh with at most one refresh per user.
+
+    A token close to expiry is renewed on a background thread while the
+    request carries on with the still valid one; only an expired token is
+    refreshed inline. Within a worker the refresh is guarded by a per-user
+    lock, across workers by a row lock (SELECT ... FOR UPDATE) on the user.
+    Whoever gets the lock second re-reads the row and finds the new tokens,
+    so a rotated refresh token is never used twice.
+    """
+
+    def __init__(self):
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._pending = set()
+        self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='strava-token')
+
+    def ensure_fresh(self, user):
+        left = (user.expires_at or 0) - time.time()
+        if not user.expires_at or left > REFRESH_AHEAD:
+            return user
+        if left > EXPIRY_SLACK:
+            self._schedule(user.id)
+            return user
+        return self.refresh(user.id) or user
+
+    def refresh(self, user_id):
+        """Refreshes the user's tokens unless someone else just did. Returns the (updated) user."""
+        with self._lock_for(user_id):
+            user = (User.query
+                    .filter_by(id=user_id)
+                    .with_for_update()
+                    .populate_existing()
+                    .first())
+            if user is None:
+                db.session.rollback()
+                return None
+            if user.expires_at and user.expires_at - time.time() > REFRESH_AHEAD:
+                db.session.commit()  # releases the row lock
+                return user
+
+            print(f"Refreshing Strava token for user {user.strava_id}.")
+            payload = {
+                'client_id': current_app.config['STRAVA_CLIENT_ID'],
+                'client_secret': current_app.config['STRAVA_CLIENT_SECRET'],
+                'grant_type': 'refresh_token',
+                'refresh_token': user.refresh_token
+            }
+            try:
+                response = strava.post('https://www.strava.com/oauth/token', data=payload)
+                response.raise_for_status()
+            except Exception:
+                db.session.rollback()
+                raise
+            new_tokens = response.json()
+
+            user.access_token = new_tokens['access_token']
+            user.refresh_token = new_tokens['refresh_token']
+            user.expires_at = new_tokens['expires_at']
+            db.session.commit()
+            print("Token successfully refreshed.")
+            return user
+
+    def _lock_for(self, user_id):
+        with self._locks_guard:
+            return self._locks.setdefault(user_id, threading.Lock())
+
+    def _schedule(self, user_id):
+        with self._locks_guard:
+            if user_id in self._pending:
+                return
+            self._pending.add(user_id)
+        self._pool.submit(self._background_refresh, current_app._get_current_object(), user_id)
+
+    def _background_refresh(self, app, user_id):
+        try:
+            with app.app_context():
+                self.refresh(user_id)
+        except Exception as e:
+            print(f"Background Strava token refresh failed for user {user_id}: {e}")
+        finally:
+            with self._locks_guard:
+                self._pending.discard(user_id)
+
+token_manager = StravaTokenManager()
+
+def refresh_strava_token(user):
+    """Returns the user with a usable Strava access token."""
+    return token_manager.ensure_fresh(user)
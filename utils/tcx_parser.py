@@ -0,0 +1,81 @@
+from xml.etree.ElementTree import iterparse
+from utils.gpx_parser import TrackPoint, track_points_to_activity, _local_name, _parse_time, _parse_float
+
+# TCX Activity/@Sport -> Strava sport type
+TCX_SPORTS = {'Running': 'Run', 'Biking': 'Ride', 'Other': 'Workout'}
+
+def _parse_int(text):
+    try: return int(float(text))
+    except (TypeError, ValueError): return None
+
+def _find(elem, name):
+    for child in elem:
+        if _local_name(child.tag) == name:
+            return child
+    return None
+
+def _to_track_point(elem):
+    """TrackPoint from a <Trackpoint>, or None when it has no position or time."""
+    values = {}
+    for child in elem:
+        name = _local_name(child.tag)
+        if name == 'Position':
+            for coordinate in child:
+                values[_local_name(coordinate.tag)] = _parse_float(coordinate.text)
+        elif name == 'HeartRateBpm':
+            value = _find(child, 'Value')
+            values['hr'] = _parse_int(value.text) if value is not None else None
+        elif name == 'Extensions':
+            # <TPX> from the ActivityExtension schema carries power and run cadence
+            for tpx in child:
+                for field in tpx:
+                    values[_local_name(field.tag)] = field.text
+        else:
+            values[name] = child.text
+
+    latitude, longitude = values.get('LatitudeDegrees'), values.get('LongitudeDegrees')
+    time = _parse_time(values.get('Time'))
+    if latitude is None or longitude is None or time is None:
+        return None
+
+    point = TrackPoint(latitude, longitude)
+    point.time = time
+    point.elevation = _parse_float(values.get('AltitudeMeters'))
+    point.hr = values.get('hr')
+    point.cad = _parse_int(values.get('Cadence') or values.get('RunCadence'))
+    point.watts = _parse_float(values.get('Watts'))
+    return point
+
+def iter_tcx_track_points(file_stream, meta=None):
+    """
+    Streams the <Trackpoint> elements of a TCX file, detaching each one once
+    read like iter_gpx_track_points does. The sport of the first activity
+    goes to meta['type'], its <Notes> to meta['name'].
+    """
+    stack = []
+    for event, elem in iterparse(file_stream, events=('start', 'end')):
+        if event == 'start':
+            stack.append(elem)
+            if meta is not None and _local_name(elem.tag) == 'Activity' and 'type' not in meta:
+                meta['type'] = TCX_SPORTS.get(elem.get('Sport'), 'Run')
+            continue
+
+        stack.pop()
+        name = _local_name(elem.tag)
+        parent = stack[-1] if stack else None
+        if name == 'Trackpoint':
+            point = _to_track_point(elem)
+            if point is not None:
+                yield point
+        elif name == 'Notes' and meta is not None and 'name' not in meta \
+                and parent is not None and _local_name(parent.tag) == 'Activity':
+            meta['name'] = (elem.text or '').strip() or None
+
+        if parent is not None and name in ('Trackpoint', 'Lap', 'Course'):
+            elem.clear()
+            parent.remove(elem)
+
+def parse_tcx_to_strava_format(file_stream, dem=None):
+    """Same as parse_gpx_to_strava_format, for Garmin Training Center (TCX) files."""
+    meta = {}
+    return track_points_to_activity(iter_tcx_track_points(file_stream, meta), meta, dem=dem, source='tcx')
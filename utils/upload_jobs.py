@@ -0,0 +1,445 @@
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from uuid import uuid4
+
+from utils.activity_streams import ActivityStreams
+from utils.activity_parser import is_activity_file_name
+from utils.parse_cache import UploadTooLarge, spool_and_hash, cache_key, encode_entry, entry_path
+from utils.shared_files import write_atomic
+
+SPOOL_MEMORY_BYTES = 8 * 1024 * 1024
+
+_worker_dem = None  # one DemTiles per pool process, so its tile LRU is reused across jobs
+
+def _parse_job(upload_path, result_path, dem_dir, digest, cache_path=None):
+    """
+    Runs in a pool process: parses the spooled upload and writes the result
+    next to it in ActivityStreams' binary form (summary in the header), plus
+    the parse cache entry when cache_path is given. Returns False when the
+    file holds no track.
+    """
+    try:
+        with open(upload_path, 'rb') as f:
+            return _parse_to_result(f, result_path, dem_dir, digest, cache_path)
+    finally:
+        os.remove(upload_path)
+
+def _parse_batch_item(source_path, member, result_path, dem_dir, cache_dir=None, max_member_bytes=None):
+    """
+    Runs in a pool process for one file of a batch. source_path is the spooled
+    upload, or the ZIP holding it when member is set; members are streamed out
+    of the archive one at a time, never extracted whole, and unpacking stops
+    with UploadTooLarge past max_member_bytes whatever size the archive
+    declared. The file is hashed on the way so a cached parse is reused.
+    Returns (key, cached), key being the parse cache key, or (None, False)
+    when the file holds no track.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES) as spool:
+        if member:
+            with zipfile.ZipFile(source_path) as archive, archive.open(member) as stream:
+                digest = spool_and_hash(stream, spool, max_bytes=max_member_bytes)
+        else:
+            with open(source_path, 'rb') as stream:
+                digest = spool_and_hash(stream, spool)
+
+        key = cache_key(digest, dem_dir)
+        cache_path = entry_path(cache_dir, key) if cache_dir else None
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'rb') as f:
+                    write_atomic(result_path, f.read())
+                os.utime(cache_path)
+                return key, True
+            except OSError:
+                pass  # evicted meanwhile, parse it after all
+
+        spool.seek(0)
+        if not _parse_to_result(spool, result_path, dem_dir, digest, cache_path):
+            return None, False
+    return key, False
+
+def _dem_tiles(dem_dir):
+    global _worker_dem
+    from utils.dem import DemTiles
+
+    if _worker_dem is None or _worker_dem.directory != dem_dir:
+        _worker_dem = DemTiles()
+        _worker_dem.directory = dem_dir
+    return _worker_dem
+
+def _parse_to_result(stream, result_path, dem_dir, digest, cache_path=None):
+    from utils.activity_parser import parse_activity_file
+
+    activity_data = parse_activity_file(stream, dem=_dem_tiles(dem_dir), digest=digest)
+    if not activity_data:
+        return False
+
+    # The cache entry is the full parse, so it doubles as the result
+    blob = encode_entry(activity_data)
+    if cache_path:
+        write_atomic(cache_path, blob)
+    write_atomic(result_path, blob)
+    return True
+
+class UploadJobs:
+    """
+    Parses activity uploads off the request path.
+
+    The upload is spooled to UPLOAD_SPOOL_DIR and handed to a bounded
+    process pool, so a big file neither holds a request worker nor is
+    limited to one core. Job state lives in small JSON files in the same
+    directory, so a client can poll any gunicorn worker on the machine.
+    on_done(state, activity_data) runs in the submitting worker once the
+    parse finished, inside an app context; the dict it returns is merged
+    into the job state. With a ParseCache in cache, uploads are hashed while
+    they are spooled and a known file skips the pool altogether.
+
+    A batch (several files, or ZIPs of them) is one job whose files are
+    parsed in parallel; its state tracks per-file status and progress.
+    """
+
+    def __init__(self, app=None):
+        self.directory = os.path.join(tempfile.gettempdir(), 'miles-to-merch-uploads')
+        self.max_workers = min(4, os.cpu_count() or 1)
+        self.max_pending = 32
+        self.max_batch_files = 100
+        self.max_member_bytes = 100 * 1024 * 1024
+        self.max_archive_bytes = 1024 * 1024 * 1024
+        self.ttl = 3600
+        self.dem_dir = None
+        self.on_done = None
+        self.cache = None
+        self._app = None
+        self._pool = None
+        self._pid = None
+        self._finisher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='upload-jobs')
+        self._pending = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._app = app
+        self.directory = app.config.get('UPLOAD_SPOOL_DIR') or self.directory
+        self.max_workers = app.config.get('UPLOAD_WORKERS') or self.max_workers
+        self.max_pending = app.config.get('UPLOAD_MAX_PENDING', self.max_pending)
+        self.max_batch_files = app.config.get('UPLOAD_MAX_BATCH_FILES', self.max_batch_files)
+        self.max_member_bytes = app.config.get('UPLOAD_MAX_MEMBER_BYTES', self.max_member_bytes)
+        self.max_archive_bytes = app.config.get('UPLOAD_MAX_ARCHIVE_BYTES', self.max_archive_bytes)
+        self.dem_dir = app.config.get('DEM_DIR')
+        os.makedirs(self.directory, exist_ok=True)
+
+    @property
+    def pool(self):
+        # Created lazily per process; spawned children don't inherit the worker's threads or sockets
+        if self._pool is None or self._pid != os.getpid():
+            with self._lock:
+                if self._pool is None or self._pid != os.getpid():
+                    self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+                    self._pid = os.getpid()
+        return self._pool
+
+    def _submit(self, fn, *args):
+        """
+        Queues fn on the pool. A pool whose child died (e.g. OOM-killed on a
+        huge file) is broken for good, so it's replaced and the call retried.
+        Never raises: a failed submit comes back as a failed future.
+        """
+        for attempt in range(2):
+            pool = self.pool
+            try:
+                return pool.submit(fn, *args)
+            except BrokenProcessPool as e:
+                error = e
+                with self._lock:
+                    if self._pool is pool:
+                        self._pool = None
+                pool.shutdown(wait=False)
+            except Exception as e:
+                error = e
+                break
+        future = Future()
+        future.set_exception(error)
+        return future
+
+    # --- Paths and state ---
+
+    def _path(self, job_id, suffix):
+        return os.path.join(self.directory, f'{job_id}.{suffix}')
+
+    def _write_state(self, job_id, state):
+        write_atomic(self._path(job_id, 'json'), json.dumps(state))
+
+    def get(self, job_id):
+        """The job's state dict, or None for an unknown (or expired) job."""
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(self._path(job_id, 'json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def result(self, job_id):
+        """The parsed activity of a finished job, with 'streams' as ActivityStreams."""
+        return self._read_result(self._path(job_id, 'result'))
+
+    @staticmethod
+    def _read_result(path):
+        with open(path, 'rb') as f:
+            streams, meta = ActivityStreams.from_bytes(f.read())
+        activity_data = meta['details']
+        activity_data['streams'] = streams
+        return activity_data
+
+    # --- Submitting ---
+
+    def submit(self, user_id, file_storage, filename=None):
+        """
+        Spools the upload and queues it. Returns the job state, or None when
+        this worker already has max_pending jobs waiting.
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                return None
+            self._pending += 1
+
+        job_id = uuid4().hex
+        upload_path = self._path(job_id, 'upload')
+        result_path = self._path(job_id, 'result')
+        try:
+            with open(upload_path, 'wb') as f:
+                digest = spool_and_hash(file_storage.stream, f)
+            state = {
+                'job_id': job_id,
+                'user_id': user_id,
+                'filename': filename,
+                'digest': digest,
+                'cache_key': self.cache.key(digest) if self.cache else None,
+                'status': 'queued',
+                'created_at': time.time(),
+            }
+
+            cached = self.cache.get_bytes(state['cache_key']) if self.cache else None
+            if cached is not None:
+                state['cached'] = True
+            self._write_state(job_id, state)
+
+            if cached is not None:
+                # Seen this exact file before: the cached parse becomes the result
+                os.remove(upload_path)
+                write_atomic(result_path, cached)
+                future = Future()
+                future.set_result(True)
+            else:
+                cache_path = self.cache.path(state['cache_key']) if self.cache else None
+                future = self._submit(_parse_job, upload_path, result_path, self.dem_dir, digest, cache_path)
+        except BaseException:
+            # e.g. the client went away mid-upload: give the slot back
+            self._release([upload_path])
+            raise
+        future.add_done_callback(lambda f: self._finisher.submit(self._finish, state, f))
+        if self._pending == 1:
+            self._finisher.submit(self._prune)
+        return state
+
+    def _finish(self, state, future):
+        job_id = state['job_id']
+        state = dict(state, finished_at=time.time())
+        try:
+            if not future.result():
+                state.update(status='failed', error='Could not parse activity file')
+            else:
+                state['status'] = 'done'
+                if self.cache and not state.get('cached'):
+                    self.cache.added(state['cache_key'])
+                if self.on_done:
+                    with self._app.app_context():
+                        state.update(self.on_done(state, self.result(job_id)) or {})
+        except BrokenProcessPool as e:
+            print(f"Upload job {job_id}: parser process died: {e}")
+            state.update(status='failed', error='Could not process activity file')
+        except Exception as e:
+            print(f"Upload job {job_id} failed: {e}")
+            state.update(status='failed', error='Invalid activity file')
+        finally:
+            with self._lock:
+                self._pending -= 1
+        self._write_state(job_id, state)
+
+    # --- Batches ---
+
+    def submit_batch(self, user_id, file_storages):
+        """
+        Spools a set of uploads (activity files and/or ZIPs of them) and queues
+        every activity file in them. Returns the batch state, or None when this
+        worker already has max_pending jobs waiting; a batch counts as one.
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                return None
+            self._pending += 1
+
+        batch_id = uuid4().hex
+        sources, files, items = [], [], []
+        try:
+            self._spool_batch(batch_id, file_storages, sources, files, items)
+            failed = sum(1 for entry in files if entry['status'] == 'failed')
+            batch = {
+                'job_id': batch_id,
+                'kind': 'batch',
+                'user_id': user_id,
+                'status': 'running',
+                'total': len(files),
+                'completed': failed,
+                'failed': failed,
+                'created_at': time.time(),
+                'files': files,
+            }
+            if files and len(files) <= self.max_batch_files:
+                self._write_state(batch_id, batch)
+        except BaseException:
+            # e.g. the client went away mid-upload: give the slot back
+            self._release(sources)
+            raise
+        if not files or len(files) > self.max_batch_files:
+            batch.update(status='failed', error='No GPX, TCX or FIT files found' if not files else
+                         f'At most {self.max_batch_files} files per batch')
+            self._end_batch(batch, sources)
+            return batch
+
+        # From here on _end_batch releases the slot, once every file is finished
+        cache_dir = self.cache.directory if self.cache else None
+        queued = 0
+        for index, item in enumerate(items):
+            if item is None:
+                continue
+            source_path, member = item
+            future = self._submit(_parse_batch_item, source_path, member,
+                                  self._path(batch_id, f'{index}.result'), self.dem_dir, cache_dir,
+                                  self.max_member_bytes)
+            future.add_done_callback(
+                lambda f, index=index: self._finisher.submit(self._finish_batch_item, batch, sources, index, f))
+            queued += 1
+        if not queued:
+            self._finisher.submit(self._end_batch, batch, sources)
+        if self._pending == 1:
+            self._finisher.submit(self._prune)
+        return dict(batch)
+
+    def _spool_batch(self, batch_id, file_storages, sources, files, items):
+        """
+        Saves the uploads and lists the activity files in them (files/items are
+        filled in place). ZIP members bigger than max_member_bytes unpacked
+        fail on their own; an archive whose members add up to more than
+        max_archive_bytes fails whole, before anything is unpacked.
+        """
+        for index, file_storage in enumerate(file_storages):
+            source_path = self._path(batch_id, f'{index}.upload')
+            sources.append(source_path)
+            file_storage.save(source_path)  # streamed to disk in chunks
+            if not zipfile.is_zipfile(source_path):
+                files.append({'name': file_storage.filename, 'status': 'queued'})
+                items.append((source_path, None))
+                continue
+            try:
+                with zipfile.ZipFile(source_path) as archive:
+                    members = [info for info in archive.infolist()
+                               if not info.is_dir() and is_activity_file_name(info.filename)]
+            except zipfile.BadZipFile:
+                files.append({'name': file_storage.filename, 'status': 'failed', 'error': 'Invalid ZIP file'})
+                items.append(None)
+                continue
+            if sum(info.file_size for info in members) > self.max_archive_bytes:
+                files.append({'name': file_storage.filename, 'status': 'failed', 'error': 'ZIP file too large when unpacked'})
+                items.append(None)
+                continue
+            for info in members:
+                name = f'{file_storage.filename}/{info.filename}'
+                if info.file_size > self.max_member_bytes:
+                    files.append({'name': name, 'status': 'failed', 'error': 'File too large when unpacked'})
+                    items.append(None)
+                else:
+                    files.append({'name': name, 'status': 'queued'})
+                    items.append((source_path, info.filename))
+
+    def _release(self, paths):
+        """Gives back a pending slot of a submit that failed, removing what it spooled."""
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self._lock:
+            self._pending -= 1
+
+    def _finish_batch_item(self, batch, sources, index, future):
+        # Only ever runs on the single finisher thread, so batch needs no lock
+        entry = batch['files'][index]
+        result_path = self._path(batch['job_id'], f'{index}.result')
+        try:
+            key, cached = future.result()
+            if key is None:
+                entry.update(status='failed', error='Could not parse activity file')
+            else:
+                activity_data = self._read_result(result_path)
+                if self.cache and not cached:
+                    self.cache.added(key)
+                entry['status'] = 'done'
+                if self.on_done:
+                    with self._app.app_context():
+                        entry.update(self.on_done({'user_id': batch['user_id']}, activity_data) or {})
+                entry['activity'] = {k: v for k, v in activity_data.items() if k != 'streams'}
+        except UploadTooLarge:
+            entry.update(status='failed', error='File too large when unpacked')
+        except BrokenProcessPool as e:
+            print(f"Upload batch {batch['job_id']}: parser process died on {entry['name']}: {e}")
+            entry.update(status='failed', error='Could not process activity file')
+        except Exception as e:
+            print(f"Upload batch {batch['job_id']}: {entry['name']} failed: {e}")
+            entry.update(status='failed', error='Invalid activity file')
+        finally:
+            try:
+                os.remove(result_path)
+            except OSError:
+                pass
+
+        batch['completed'] += 1
+        if entry['status'] == 'failed':
+            batch['failed'] += 1
+        if batch['completed'] >= batch['total']:
+            self._end_batch(batch, sources)
+        else:
+            self._write_state(batch['job_id'], batch)
+
+    def _end_batch(self, batch, sources):
+        if batch['status'] == 'running':
+            batch['status'] = 'done'
+        batch['finished_at'] = time.time()
+        for path in sources:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self._lock:
+            self._pending -= 1
+        self._write_state(batch['job_id'], batch)
+
+    def _prune(self):
+        """Drops state and results of jobs older than the TTL."""
+        cutoff = time.time() - self.ttl
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass